@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import threading
+import time
+from metadata import read_video_id
+
+# Имя файла индекса внутри папки загрузок
+ARCHIVE_FILENAME = ".download_archive.sqlite3"
+
+# Расширения файлов, которые учитываются при пересборке индекса
+AUDIO_EXTENSIONS = ('.mp3', '.opus', '.ogg', '.m4a', '.flac')
+# Как часто пересборка индекса сообщает о ходе работы (число просмотренных аудиофайлов)
+REBUILD_LOG_EVERY = 500
+
+
+class DownloadArchive:
+    def __init__(self, db_path, library_folder=None):
+        """
+        Постоянный индекс уже скачанных видео на SQLite, ключ — ID видео.
+        Хранит путь к файлу, размер, кодек и признак внедрённых метаданных.
+        :param db_path: Путь к файлу базы.
+        :param library_folder: Папка с аудио. Если база создаётся впервые,
+                               индекс пересобирается сканированием этой папки —
+                               не здесь, а при первом обращении (см. ensure_ready).
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._ready = threading.Event()
+        is_new = not os.path.exists(db_path)
+        # Одно соединение на все потоки, доступ сериализуется через self._lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                " video_id TEXT PRIMARY KEY,"
+                " path TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " codec TEXT,"
+                " tagged INTEGER NOT NULL DEFAULT 0,"
+                " updated REAL NOT NULL)"
+            )
+        # Обход большой библиотеки с чтением тегов занимает минуты, поэтому
+        # конструктор (он вызывается и в главном потоке окна) только запоминает папку
+        self._rebuild_folder = library_folder if is_new else None
+        if not self._rebuild_folder:
+            self._ready.set()
+
+    def is_ready(self):
+        """
+        True, если пересборка индекса не нужна или уже выполнена,
+        то есть обращения к индексу не будут её ждать.
+        """
+        return self._ready.is_set()
+
+    def ensure_ready(self, log_callback=None):
+        """
+        Выполняет отложенную пересборку индекса, если она ещё не выполнена.
+        Вызывается перед каждым обращением к индексу; потоки, обратившиеся
+        во время пересборки, ждут её окончания.
+        :param log_callback: Необязательная функция для сообщений о ходе пересборки.
+        """
+        if self._ready.is_set():
+            return
+        with self._rebuild_lock:
+            if self._ready.is_set():
+                return
+            if log_callback:
+                log_callback(f"Пересборка индекса скачанного: сканирование {self._rebuild_folder}...")
+            try:
+                count = self.rebuild(self._rebuild_folder, log_callback)
+            finally:
+                # Даже после сбоя индекс пригоден: пустой индекс лишь не пропускает скачанное
+                self._ready.set()
+            if log_callback:
+                log_callback(f"Индекс скачанного пересобран: найдено файлов — {count}.")
+
+    def get(self, video_id):
+        """
+        Возвращает запись о скачанном видео в виде словаря или None.
+        Если файл был удалён с диска, запись удаляется и возвращается None.
+        """
+        if not video_id:
+            return None
+        self.ensure_ready()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size, codec, tagged FROM downloads WHERE video_id = ?",
+                (video_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        path, size, codec, tagged = row
+        if not os.path.exists(path):
+            self.remove(video_id)
+            return None
+        return {'path': path, 'size': size, 'codec': codec, 'tagged': bool(tagged)}
+
+    def downloaded_ids(self, video_ids):
+        """
+        Возвращает множество ID из video_ids, которые уже скачаны (файл на месте).
+        Проверяет весь список небольшим числом запросов — для массового импорта ссылок.
+        """
+        video_ids = [video_id for video_id in set(video_ids) if video_id]
+        self.ensure_ready()
+        rows = []
+        with self._lock:
+            # Ограничение SQLite на число параметров запроса — 999
+            for start in range(0, len(video_ids), 500):
+                chunk = video_ids[start:start + 500]
+                rows += self._conn.execute(
+                    f"SELECT video_id, path FROM downloads WHERE video_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        return {video_id for video_id, path in rows if os.path.exists(path)}
+
+    def __contains__(self, video_id):
+        return self.get(video_id) is not None
+
+    def record(self, video_id, path, codec, tagged):
+        """
+        Добавляет или обновляет запись о скачанном видео.
+        """
+        if not video_id or not os.path.exists(path):
+            return
+        # Пересборка очищает таблицу — запись, сделанная до неё, потерялась бы
+        self.ensure_ready()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads (video_id, path, size, codec, tagged, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, os.path.abspath(path), os.path.getsize(path), codec, int(bool(tagged)), time.time()),
+            )
+
+    def remove(self, video_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM downloads WHERE video_id = ?", (video_id,))
+
+    def rebuild(self, library_folder, log_callback=None):
+        """
+        Пересобирает индекс, сканируя папку с аудио. ID видео берётся из тегов файла,
+        поэтому в индекс попадают только файлы, скачанные с метаданными.
+        Возвращает количество найденных файлов.
+        :param log_callback: Необязательная функция, которой раз в REBUILD_LOG_EVERY
+                             файлов сообщается о ходе сканирования.
+        """
+        rows = []
+        scanned = 0
+        for dirpath, _, filenames in os.walk(library_folder):
+            for filename in filenames:
+                _, ext = os.path.splitext(filename)
+                if ext.lower() not in AUDIO_EXTENSIONS:
+                    continue
+                scanned += 1
+                if log_callback and scanned % REBUILD_LOG_EVERY == 0:
+                    log_callback(f"Пересборка индекса: просмотрено файлов — {scanned}, найдено — {len(rows)}.")
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                video_id = read_video_id(path)
+                if video_id:
+                    rows.append((video_id, path, os.path.getsize(path), ext[1:].lower(), 1, time.time()))
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM downloads")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO downloads (video_id, path, size, codec, tagged, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
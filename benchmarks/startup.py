@@ -0,0 +1,130 @@
+"""
+Замер времени запуска: время до первого окна GUI и холодный старт командной строки.
+
+Каждый замер — отдельный процесс Python, время считается от запуска процесса
+до момента, когда приложение готово к работе. Дополнительно проверяется, что
+тяжёлые модули (yt_dlp, Pillow, mutagen) не загружаются при старте.
+
+Пример:
+    python benchmarks/startup.py --runs 10 --max-cli-ms 300 --max-gui-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые должны импортироваться только при скачивании или записи тегов
+HEAVY_MODULES = ('yt_dlp', 'PIL', 'mutagen')
+
+_REPORT_HEAVY = (
+    "import json, sys\n"
+    f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+    "print(json.dumps(heavy), flush=True)\n"
+)
+
+CLI_SNIPPET = (
+    "import cli\n"
+    "cli.build_parser()\n"
+) + _REPORT_HEAVY
+
+GUI_SNIPPET = (
+    "import tkinter as tk\n"
+    "from gui import YouTubeAudioDownloaderApp\n"
+    "root = tk.Tk()\n"
+    "app = YouTubeAudioDownloaderApp(root)\n"
+    "root.update()\n"
+) + _REPORT_HEAVY + "root.destroy()\n"
+
+
+def measure(snippet, workdir):
+    """
+    Запускает фрагмент кода в новом процессе и возвращает
+    (время до первой строки вывода в мс, список тяжёлых модулей) или None при ошибке.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE='1')
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', snippet],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    line = process.stdout.readline()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _, stderr = process.communicate()
+    if process.returncode != 0 or not line:
+        sys.stderr.write(stderr)
+        return None
+    return elapsed_ms, json.loads(line)
+
+
+def run_series(name, snippet, runs, workdir):
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        result = measure(snippet, workdir)
+        if result is None:
+            return {'name': name, 'error': 'процесс завершился с ошибкой'}
+        timings.append(result[0])
+        heavy.update(result[1])
+    return {
+        'name': name,
+        'runs': runs,
+        'min_ms': round(min(timings), 1),
+        'median_ms': round(statistics.median(timings), 1),
+        'max_ms': round(max(timings), 1),
+        'heavy_modules': sorted(heavy),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='количество запусков каждого замера')
+    parser.add_argument('--no-gui', action='store_true', help='не замерять GUI (нет графической среды)')
+    parser.add_argument('--max-cli-ms', type=float, help='порог медианы для командной строки')
+    parser.add_argument('--max-gui-ms', type=float, help='порог медианы для GUI')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    # Временная рабочая папка: GUI создаёт Downloaded_Audio в текущем каталоге
+    with tempfile.TemporaryDirectory() as workdir:
+        results.append(run_series('cli_cold_start', CLI_SNIPPET, args.runs, workdir))
+        if not args.no_gui:
+            results.append(run_series('gui_first_window', GUI_SNIPPET, args.runs, workdir))
+
+    limits = {'cli_cold_start': args.max_cli_ms, 'gui_first_window': args.max_gui_ms}
+    failed = False
+    for result in results:
+        limit = limits.get(result['name'])
+        result['ok'] = (
+            'error' not in result
+            and not result['heavy_modules']
+            and (limit is None or result['median_ms'] <= limit)
+        )
+        failed = failed or not result['ok']
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            if 'error' in result:
+                print(f"{result['name']}: {result['error']}")
+                continue
+            print(f"{result['name']}: медиана {result['median_ms']} мс "
+                  f"(мин {result['min_ms']}, макс {result['max_ms']}, запусков {result['runs']})"
+                  + (f", тяжёлые модули при старте: {', '.join(result['heavy_modules'])}"
+                     if result['heavy_modules'] else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
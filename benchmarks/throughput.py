@@ -0,0 +1,478 @@
+"""
+Замер пропускной способности Downloader без доступа в интернет.
+
+Скрипт поднимает локальный HTTP-сервер со сгенерированными аудиофайлами и
+WebP-миниатюрами, а ссылки на него разбирает экстрактор-заглушка
+(benchmarks/yt_dlp_plugins). Замеряются:
+  * полный путь ссылки на плейлист — треков в минуту через download_audio
+    (последовательно) и через конвейер start_download с разным числом потоков;
+  * отдельные этапы: convert_thumbnail, add_metadata и перекодирование ffmpeg
+    (без тегов и с тегами и обложкой, записанными в том же проходе).
+
+Результаты можно сохранить в JSON (--output) и сравнить с сохранёнными ранее
+(--baseline): так любое изменение производительности проверяется против базы.
+
+Пример:
+    python benchmarks/throughput.py --sizes 5 20 --jobs 1 2 4 --output base.json
+    python benchmarks/throughput.py --baseline base.json --max-regression 10
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+# Папка скрипта нужна в sys.path, чтобы yt_dlp нашёл плагин-заглушку
+for path in (BENCH_DIR, REPO_ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from archive import AUDIO_EXTENSIONS  # noqa: E402
+from downloader import OUTPUT_MP3, OUTPUT_NATIVE, Downloader, Track  # noqa: E402
+from metadata import DEFAULT_COVER_SIZE, add_metadata, convert_thumbnail  # noqa: E402
+from tools import find_ffmpeg  # noqa: E402
+
+# Размер блока при отдаче файлов с ограничением скорости
+_CHUNK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+THUMBNAIL_SIZE = (1280, 720)
+AUDIO_BITRATE = 96  # кбит/с сгенерированной дорожки Opus
+
+
+def make_fixtures(folder, ffmpeg_path, duration):
+    """
+    Генерирует тестовые файлы: дорожку Opus в WebM, её копии в MP3 и Opus
+    (для замера тегов) и миниатюру в WebP и JPEG.
+    Возвращает словарь имя -> байты.
+    """
+    from PIL import Image, ImageFilter
+
+    sine = ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+    outputs = {
+        'webm': ['-codec:a', 'libopus', '-b:a', f'{AUDIO_BITRATE}k'],
+        'mp3': ['-codec:a', 'libmp3lame', '-b:a', '192k'],
+        'opus': ['-codec:a', 'libopus', '-b:a', f'{AUDIO_BITRATE}k'],
+    }
+    fixtures = {}
+    for ext, codec_args in outputs.items():
+        path = os.path.join(folder, 'audio.' + ext)
+        subprocess.run(
+            [ffmpeg_path, '-y', '-loglevel', 'error', *sine, *codec_args, path],
+            check=True,
+        )
+        with open(path, 'rb') as f:
+            fixtures[ext] = f.read()
+
+    # Размытый шум сжимается примерно как настоящая миниатюра (около 100 КБ)
+    channels = [Image.effect_noise(THUMBNAIL_SIZE, 48) for _ in range(3)]
+    image = Image.merge('RGB', channels).filter(ImageFilter.GaussianBlur(2))
+    for fmt, ext in (('WEBP', 'webp'), ('JPEG', 'jpg')):
+        path = os.path.join(folder, 'cover.' + ext)
+        image.save(path, fmt, quality=85)
+        with open(path, 'rb') as f:
+            fixtures[ext] = f.read()
+    return fixtures
+
+
+class _BenchHandler(BaseHTTPRequestHandler):
+    """
+    Отдаёт ответы «сайта» для экстрактора-заглушки:
+      /api/playlist/<N>   — плейлист из N треков;
+      /api/video/<id>     — сведения о видео;
+      /media/<id>.webm    — аудиодорожка, /media/<id>.webp — миниатюра.
+    """
+    # HTTP/1.1: соединения остаются открытыми между запросами, как у настоящего сервера
+    protocol_version = 'HTTP/1.1'
+    # Без этого заголовки и тело уходят разными пакетами и ответ ждёт задержанного ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        try:
+            if len(parts) == 3 and parts[:2] == ['api', 'playlist'] and parts[2].isdigit():
+                self._send_api({
+                    'title': f'Benchmark {parts[2]}',
+                    'entries': [
+                        {'id': f'track{index:04d}', 'title': f'Track {index}'}
+                        for index in range(1, int(parts[2]) + 1)
+                    ],
+                })
+            elif len(parts) == 3 and parts[:2] == ['api', 'video']:
+                fixtures = self.server.fixtures
+                self._send_api({
+                    'title': f'Track {parts[2]}',
+                    'uploader': 'Benchmark',
+                    'duration': self.server.duration,
+                    'abr': AUDIO_BITRATE,
+                    'filesize': len(fixtures['webm']),
+                    'thumbnail_width': THUMBNAIL_SIZE[0],
+                    'thumbnail_height': THUMBNAIL_SIZE[1],
+                })
+            elif len(parts) == 2 and parts[0] == 'media' and parts[1].endswith(('.webm', '.webp')):
+                ext = parts[1].rsplit('.', 1)[1]
+                content_type = 'audio/webm' if ext == 'webm' else 'image/webp'
+                self._send(self.server.fixtures[ext], content_type, self.server.bandwidth)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл соединение (например, при остановке загрузки)
+            pass
+
+    def _send_api(self, data):
+        # Задержка имитирует время ответа страницы видео
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self._send(json.dumps(data).encode('utf-8'), 'application/json', None)
+
+    def _send(self, body, content_type, bandwidth):
+        # Поддержка Range нужна, чтобы yt_dlp мог продолжить загрузку с файла .part
+        match = _RANGE_RE.match(self.headers.get('Range') or '')
+        start = int(match.group(1)) if match else 0
+        if match and start < len(body):
+            end = min(int(match.group(2)), len(body) - 1) if match.group(2) else len(body) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        started = time.monotonic()
+        for offset in range(0, len(body), _CHUNK_SIZE):
+            self.wfile.write(body[offset:offset + _CHUNK_SIZE])
+            delay = (offset + _CHUNK_SIZE) / bandwidth - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchServer:
+    def __init__(self, fixtures, duration, bandwidth=None, latency=0.0):
+        """
+        Локальный HTTP-сервер замера в отдельном потоке.
+        :param fixtures: Словарь с байтами тестовых файлов (см. make_fixtures).
+        :param duration: Длительность дорожки в секундах (для сведений о видео).
+        :param bandwidth: Ограничение скорости отдачи файлов на соединение, байт/с (None — без ограничения).
+        :param latency: Задержка ответа API в секундах.
+        """
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _BenchHandler)
+        self._server.daemon_threads = True
+        self._server.fixtures = fixtures
+        self._server.duration = duration
+        self._server.bandwidth = bandwidth
+        self._server.latency = latency
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bench-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def summarize(name, params, timings, work=1, unit='ops/s'):
+    """
+    Сводка серии замеров. Пропускная способность считается по медиане:
+    work единиц работы за медианное время (для unit='tracks/min' — в минуту).
+    """
+    median = statistics.median(timings)
+    scale = 60 if unit == 'tracks/min' else 1
+    return {
+        'name': name,
+        'params': params,
+        'runs': len(timings),
+        'median_seconds': round(median, 4),
+        'min_seconds': round(min(timings), 4),
+        'max_seconds': round(max(timings), 4),
+        'throughput': round(work / median * scale, 2) if median > 0 else None,
+        'unit': unit,
+    }
+
+
+def _new_downloader(folder, args):
+    downloader = Downloader(folder, log_callback=lambda message: None, progress_callback=lambda value: None)
+    downloader.quiet = True
+    downloader.with_metadata = not args.no_metadata
+    downloader.output_format = OUTPUT_NATIVE if args.native else OUTPUT_MP3
+    return downloader
+
+
+def run_end_to_end(base_url, size, jobs, args):
+    """
+    Один прогон плейлиста из size треков в пустой папке (чтобы индекс скачанного
+    и кэш не пропускали треки). jobs=None — последовательный download_audio.
+    Возвращает (секунды, число готовых файлов).
+    """
+    url = f'{base_url}/bench/playlist/{size}'
+    with tempfile.TemporaryDirectory() as folder:
+        downloader = _new_downloader(folder, args)
+        started = time.perf_counter()
+        if jobs is None:
+            downloader.download_audio(url)
+        else:
+            downloader.max_workers = jobs
+            downloader.start_download([url], lambda: None)
+            downloader.thread.join()
+        elapsed = time.perf_counter() - started
+        produced = sum(
+            1
+            for _, _, files in os.walk(folder)
+            for name in files
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+        downloader.archive.close()
+        downloader.journal.close()
+    return elapsed, produced
+
+
+def bench_end_to_end(base_url, args):
+    results = []
+    for size in args.sizes:
+        for jobs in [None] + args.jobs:
+            name = 'download_audio' if jobs is None else 'pipeline'
+            params = {'tracks': size} if jobs is None else {'tracks': size, 'jobs': jobs}
+            timings = []
+            error = None
+            for _ in range(args.runs):
+                elapsed, produced = run_end_to_end(base_url, size, jobs, args)
+                if produced != size:
+                    error = f'готово {produced} из {size} треков'
+                    break
+                timings.append(elapsed)
+            if error:
+                results.append({'name': name, 'params': params, 'error': error})
+            else:
+                results.append(summarize(name, params, timings, work=size, unit='tracks/min'))
+    return results
+
+
+def measure_operation(operation, prepare, iterations):
+    """
+    Замеряет operation(prepare()) iterations раз; подготовка в замер не входит.
+    """
+    timings = []
+    for index in range(iterations):
+        argument = prepare(index)
+        started = time.perf_counter()
+        operation(argument)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_stages(fixtures, workdir, args):
+    results = []
+    iterations = args.iterations
+
+    for source in ('webp', 'jpg'):
+        timings = measure_operation(
+            lambda data: convert_thumbnail(data, DEFAULT_COVER_SIZE),
+            lambda index: fixtures[source],
+            iterations,
+        )
+        results.append(summarize('convert_thumbnail', {'source': source, 'max_size': DEFAULT_COVER_SIZE}, timings))
+
+    cover = convert_thumbnail(fixtures['webp'], DEFAULT_COVER_SIZE)
+    info = {'id': 'track0001', 'title': 'Track 1', 'uploader': 'Benchmark', 'playlist_title': 'Benchmark'}
+    for ext in ('mp3', 'opus'):
+        folder = os.path.join(workdir, 'tag-' + ext)
+        os.makedirs(folder)
+
+        def prepare(index, ext=ext, folder=folder):
+            path = os.path.join(folder, f'{index}.{ext}')
+            with open(path, 'wb') as f:
+                f.write(fixtures[ext])
+            return path
+
+        timings = measure_operation(lambda path: add_metadata(path, info, cover), prepare, iterations)
+        results.append(summarize('add_metadata', {'format': ext}, timings))
+
+    downloader_folder = os.path.join(workdir, 'transcode')
+    downloader = _new_downloader(downloader_folder, args)
+    # С tags=True ffmpeg в том же проходе записывает теги и обложку (отдельный этап add_metadata не нужен)
+    for output_format, tags in itertools.product((OUTPUT_MP3, OUTPUT_NATIVE), (False, True)):
+        downloader.output_format = output_format
+        downloader.with_metadata = tags
+        folder = os.path.join(workdir, f'transcode-{output_format}-{int(tags)}')
+        os.makedirs(folder)
+
+        def prepare(index, folder=folder):
+            path = os.path.join(folder, f'{index}.webm')
+            with open(path, 'wb') as f:
+                f.write(fixtures['webm'])
+            track = Track(path, dict(info, requested_downloads=[{'filepath': path, 'acodec': 'opus'}]))
+            track.thumbnail_data = fixtures['webp']
+            return track
+
+        timings = measure_operation(downloader._transcode, prepare, iterations)
+        params = {'output': output_format, 'duration': args.duration, 'tags': tags}
+        results.append(summarize('transcode', params, timings))
+    downloader.archive.close()
+    downloader.journal.close()
+    return results
+
+
+def result_key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare_with_baseline(results, baseline, max_regression):
+    """
+    Добавляет к результатам изменение пропускной способности относительно базы.
+    Возвращает False, если какой-либо замер замедлился сильнее max_regression процентов.
+    """
+    previous = {result_key(result): result for result in baseline.get('results', [])}
+    ok = True
+    for result in results:
+        base = previous.get(result_key(result))
+        if not base or not base.get('throughput') or not result.get('throughput'):
+            continue
+        change = (result['throughput'] - base['throughput']) / base['throughput'] * 100
+        result['baseline_throughput'] = base['throughput']
+        result['change_percent'] = round(change, 1)
+        if max_regression is not None and change < -max_regression:
+            result['ok'] = False
+            ok = False
+    return ok
+
+
+def describe_environment(args):
+    try:
+        import yt_dlp.version
+        yt_dlp_version = yt_dlp.version.__version__
+    except ImportError:
+        yt_dlp_version = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'yt_dlp': yt_dlp_version,
+        'options': {
+            'duration': args.duration,
+            'bandwidth': args.bandwidth,
+            'latency_ms': args.latency_ms,
+            'metadata': not args.no_metadata,
+            'native': args.native,
+        },
+    }
+
+
+def format_result(result):
+    params = ", ".join(f"{key}={value}" for key, value in result['params'].items())
+    title = f"{result['name']} ({params})"
+    if 'error' in result:
+        return f"{title}: {result['error']}"
+    line = (f"{title}: {result['throughput']} {result['unit']}, "
+            f"медиана {result['median_seconds'] * 1000:.1f} мс "
+            f"(мин {result['min_seconds'] * 1000:.1f}, макс {result['max_seconds'] * 1000:.1f})")
+    if 'change_percent' in result:
+        line += f", к базе {result['change_percent']:+.1f}%"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20], help='размеры плейлистов')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4],
+                        help='числа параллельных загрузок для конвейера')
+    parser.add_argument('--runs', type=int, default=3, help='повторов каждого полного прогона')
+    parser.add_argument('--iterations', type=int, default=20, help='повторов каждого замера этапа')
+    parser.add_argument('--duration', type=int, default=30, help='длительность тестовой дорожки, секунд')
+    parser.add_argument('--bandwidth', type=int,
+                        help='ограничение скорости отдачи на соединение, КБ/с (по умолчанию без ограничения)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='задержка ответа API сервера, мс')
+    parser.add_argument('--no-metadata', action='store_true', help='не добавлять метаданные в полных прогонах')
+    parser.add_argument('--native', action='store_true', help='сохранять исходный кодек без перекодирования')
+    parser.add_argument('--no-end-to-end', action='store_true', help='не выполнять полные прогоны')
+    parser.add_argument('--no-stages', action='store_true', help='не замерять отдельные этапы')
+    parser.add_argument('--output', metavar='FILE', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='сравнить с результатами, сохранёнными ранее')
+    parser.add_argument('--max-regression', type=float,
+                        help='допустимое замедление относительно базы, процентов')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args(argv)
+    if min(args.sizes + args.jobs + [args.runs, args.iterations, args.duration]) < 1:
+        parser.error('размеры, числа потоков и повторов должны быть не меньше 1')
+
+    ffmpeg_path, _, _ = find_ffmpeg()
+    if not ffmpeg_path:
+        print('ffmpeg не найден ни в папке bin, ни в PATH.', file=sys.stderr)
+        return 2
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='ytad-bench-')
+    try:
+        fixtures = make_fixtures(workdir, ffmpeg_path, args.duration)
+        if not args.no_end_to_end:
+            server = BenchServer(
+                fixtures,
+                args.duration,
+                bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+                latency=args.latency_ms / 1000,
+            )
+            server.start()
+            try:
+                results += bench_end_to_end(server.base_url, args)
+            finally:
+                server.stop()
+        if not args.no_stages:
+            results += bench_stages(fixtures, workdir, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = all('error' not in result for result in results)
+    if baseline is not None:
+        ok = compare_with_baseline(results, baseline, args.max_regression) and ok
+
+    document = {'environment': describe_environment(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(document, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            print(format_result(result))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Экстрактор-заглушка для benchmarks/throughput.py.
+
+Подключается к yt_dlp как плагин (пакет yt_dlp_plugins лежит рядом со скриптом
+замера, а папка скрипта при запуске попадает в sys.path). Обслуживает только
+ссылки локального сервера замера и возвращает такие же словари, как настоящий
+экстрактор: плейлист — «плоскими» записями, видео — с форматами и миниатюрами.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchStubIE(InfoExtractor):
+    IE_NAME = 'bench:video'
+    _VALID_URL = r'(?P<base>http://127\.0\.0\.1:\d+)/bench/video/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, video_id = self._match_valid_url(url).group('base', 'id')
+        # Запрос к «странице видео»: как и у настоящего экстрактора, один сетевой запрос на трек
+        data = self._download_json(f'{base}/api/video/{video_id}', video_id)
+        return {
+            'id': video_id,
+            'title': data['title'],
+            'uploader': data['uploader'],
+            'duration': data['duration'],
+            'formats': [{
+                'format_id': 'opus',
+                'url': f'{base}/media/{video_id}.webm',
+                'ext': 'webm',
+                'acodec': 'opus',
+                'vcodec': 'none',
+                'abr': data['abr'],
+                'filesize': data['filesize'],
+            }],
+            'thumbnails': [{
+                'url': f'{base}/media/{video_id}.webp',
+                'width': data['thumbnail_width'],
+                'height': data['thumbnail_height'],
+            }],
+        }
+
+
+class BenchStubPlaylistIE(InfoExtractor):
+    IE_NAME = 'bench:playlist'
+    _VALID_URL = r'(?P<base>http://127\.0\.0\.1:\d+)/bench/playlist/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, playlist_id = self._match_valid_url(url).group('base', 'id')
+        data = self._download_json(f'{base}/api/playlist/{playlist_id}', playlist_id)
+        entries = [
+            self.url_result(f'{base}/bench/video/{entry["id"]}', BenchStubIE.ie_key(), entry['id'], entry['title'])
+            for entry in data['entries']
+        ]
+        return self.playlist_result(entries, playlist_id, data['title'])
+
+
+class BenchStubRedirectIE(InfoExtractor):
+    """
+    Перенаправление на плейлист, как у вкладок канала или альбомов YouTube Music.
+    """
+    IE_NAME = 'bench:redirect'
+    _VALID_URL = r'(?P<base>http://127\.0\.0\.1:\d+)/bench/redirect/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, playlist_id = self._match_valid_url(url).group('base', 'id')
+        return self.url_result(f'{base}/bench/playlist/{playlist_id}', BenchStubPlaylistIE.ie_key())
+
+
+class BenchStubShelfIE(InfoExtractor):
+    """
+    Плейлист из плейлистов, как вкладка «Плейлисты» канала или полка исполнителя YouTube Music.
+    """
+    IE_NAME = 'bench:shelf'
+    _VALID_URL = r'(?P<base>http://127\.0\.0\.1:\d+)/bench/shelf/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, playlist_id = self._match_valid_url(url).group('base', 'id')
+        entries = [self.url_result(f'{base}/bench/playlist/{playlist_id}', BenchStubPlaylistIE.ie_key())]
+        return self.playlist_result(entries, f'shelf{playlist_id}', f'Shelf {playlist_id}')
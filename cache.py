@@ -0,0 +1,222 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Имя папки дискового уровня кэша внутри папки загрузок
+INFO_CACHE_DIRNAME = ".info_cache"
+
+# Ссылки на потоки YouTube перестают работать примерно через 6 часов,
+# поэтому по умолчанию храним результат извлечения не дольше часа.
+DEFAULT_TTL = 3600
+
+# Ограничение дискового уровня по размеру: кэш может лежать в рабочей папке на tmpfs
+DEFAULT_MAX_DISK_BYTES = 64 * 1024 * 1024
+
+# Поля результата извлечения, которые не нужны для скачивания аудио, но занимают
+# большую часть словаря (субтитры на десятках языков, тепловая карта просмотров)
+_UNUSED_FIELDS = ('automatic_captions', 'subtitles', 'requested_subtitles', 'heatmap', 'comments')
+
+
+def compact_info(info):
+    """
+    Копия словаря от yt_dlp только с тем, что нужно для выбора формата 'bestaudio/best'
+    и скачивания: без субтитров, тепловой карты, форматов только с видео и раскадровок.
+    """
+    info = {key: value for key, value in info.items() if key not in _UNUSED_FIELDS}
+    formats = info.get('formats')
+    if isinstance(formats, list):
+        info['formats'] = [
+            f for f in formats
+            if f.get('acodec') != 'none' and f.get('format_note') != 'storyboard' and f.get('ext') != 'mhtml'
+        ]
+    return copy.deepcopy(info)
+
+
+class InfoCache:
+    def __init__(self, max_entries=256, ttl=DEFAULT_TTL, cache_dir=None, max_disk_entries=4096,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        """
+        Кэш словарей с информацией о видео от yt_dlp, ключ — ID видео.
+        Записи хранятся в памяти с вытеснением давно не используемых (LRU)
+        и, если задан cache_dir, дублируются на диск в виде JSON-файлов.
+        Сохраняется сокращённый словарь (см. compact_info).
+        Дисковый уровень могут одновременно использовать несколько процессов,
+        поэтому файл, удалённый другим процессом, считается просто отсутствующим.
+        :param max_entries: Максимальное число записей в памяти.
+        :param ttl: Время жизни записи в секундах.
+        :param cache_dir: Папка для дискового уровня кэша (None — только память).
+        :param max_disk_entries: Максимальное число файлов на диске.
+        :param max_disk_bytes: Максимальный общий размер файлов на диске.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # video_id -> (время сохранения, info)
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, video_id):
+        """
+        Возвращает копию сохранённого словаря или None, если записи нет или она устарела.
+        """
+        if not video_id:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[video_id]
+                entry = None
+            if entry is None:
+                entry = self._read_disk(video_id, now)
+                if entry is not None:
+                    self._store(video_id, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            info = entry[1]
+        # Копия нужна, потому что yt_dlp дополняет словарь при обработке
+        return copy.deepcopy(info)
+
+    def put(self, video_id, info):
+        """
+        Сохраняет словарь в памяти и, если включён, на диске.
+        """
+        if not video_id or info is None:
+            return
+        entry = (time.time(), compact_info(info))
+        with self._lock:
+            self._store(video_id, entry)
+            self._write_disk(video_id, entry)
+
+    def invalidate(self, video_id):
+        """
+        Удаляет запись, например если ссылки на поток из неё перестали работать.
+        """
+        with self._lock:
+            self._entries.pop(video_id, None)
+            path = self._disk_path(video_id)
+            if path:
+                _remove(path)
+
+    def stats(self):
+        """
+        Счётчики для настройки размера и времени жизни кэша.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _store(self, video_id, entry):
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, video_id):
+        if not self.cache_dir:
+            return None
+        safe_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in video_id)
+        return os.path.join(self.cache_dir, safe_id + ".json")
+
+    def _read_disk(self, video_id, now):
+        path = self._disk_path(video_id)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            saved, info = data['saved'], data['info']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if now - saved > self.ttl:
+            _remove(path)
+            return None
+        try:
+            # Время доступа — для вытеснения давно не используемых файлов,
+            # время изменения остаётся временем сохранения (по нему истекает срок)
+            os.utime(path, (now, saved))
+        except OSError:
+            pass
+        return saved, info
+
+    def _write_disk(self, video_id, entry):
+        path = self._disk_path(video_id)
+        if not path:
+            return
+        # Своё имя временного файла у каждого процесса, который пишет в общую папку
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'saved': entry[0], 'info': entry[1]}, f, ensure_ascii=False)
+            os.utime(tmp_path, (entry[0], entry[0]))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            _remove(tmp_path)
+            return
+        self._disk_writes += 1
+        # Проверяем размер дискового уровня не на каждую запись, а раз в 32
+        if self._disk_writes % 32 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """
+        Удаляет с диска записи с истёкшим сроком, а затем давно не используемые,
+        пока число файлов и их общий размер не уложатся в ограничения.
+        """
+        deadline = time.time() - self.ttl
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith((".json", ".tmp")):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if stat.st_mtime < deadline:
+                        # Истёкшие записи и временные файлы процессов, прерванных во время записи
+                        _remove(entry.path)
+                    elif entry.name.endswith(".json"):
+                        files.append((stat.st_atime, stat.st_size, entry.path))
+        except OSError:
+            return
+        count = len(files)
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if count <= self.max_disk_entries and total <= self.max_disk_bytes:
+                break
+            _remove(path)
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+
+def _remove(path):
+    """
+    Удаляет файл, если он ещё есть: его мог удалить другой процесс с той же папкой кэша.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
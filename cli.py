@@ -0,0 +1,396 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from downloader import OUTPUT_MP3, OUTPUT_NATIVE, Downloader
+from journal import JobJournal
+from metadata import DEFAULT_COVER_SIZE
+from progress import METRICS_JSON, METRICS_PROMETHEUS
+from staging import STAGING_DIRNAME
+from validators import canonical_youtube_url, sanitize_filename, split_urls
+
+# Коды завершения
+EXIT_OK = 0
+EXIT_FAILED = 1  # Часть ссылок не удалось обработать
+EXIT_USAGE = 2  # Ошибка аргументов (так же завершается argparse)
+EXIT_NO_FFMPEG = 3
+EXIT_INTERRUPTED = 130
+
+# Минимальный интервал между событиями progress для одного трека, секунд
+PROGRESS_INTERVAL = 0.5
+
+
+class JsonLinesReporter:
+    def __init__(self, stream):
+        """
+        Печатает события в поток в формате JSON Lines: один объект на строку.
+        События progress одного трека прореживаются до PROGRESS_INTERVAL.
+        """
+        self.stream = stream
+        self.errors = 0
+        self.overall = 0.0
+        self._lock = threading.Lock()
+        self._last_progress = {}
+
+    def emit(self, event, fields):
+        if event == 'progress':
+            now = time.monotonic()
+            key = fields.get('id')
+            finished = fields.get('percent', 0) >= 100
+            with self._lock:
+                if not finished and now - self._last_progress.get(key, 0) < PROGRESS_INTERVAL:
+                    return
+                self._last_progress[key] = now
+            fields = dict(fields, overall=round(self.overall, 2))
+        elif event == 'error':
+            with self._lock:
+                self.errors += 1
+        record = {'event': event, 'time': round(time.time(), 3), **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self.emit('log', {'message': message})
+
+    def progress(self, value):
+        self.overall = value
+
+
+def _parse_bytes(text):
+    """
+    Разбирает число байт вида 500K, 2M или 1.5M (суффиксы K, M, G — степени 1024).
+    Возвращает None, если значение не является положительным числом.
+    """
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = text.strip().upper().removesuffix('/S').removesuffix('B')
+    multiplier = multipliers.get(value[-1:], 1)
+    if value[-1:] in multipliers:
+        value = value[:-1]
+    try:
+        amount = int(float(value) * multiplier)
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+
+def parse_rate(text):
+    """
+    Разбирает скорость вида 500K, 2M или 1.5M (байт в секунду).
+    """
+    rate = _parse_bytes(text)
+    if rate is None:
+        raise argparse.ArgumentTypeError(f"неверная скорость: {text} (нужно число больше нуля)")
+    return rate
+
+
+def parse_size(text):
+    """
+    Разбирает размер вида 64K, 10M или 1.5M (байт).
+    """
+    size = _parse_bytes(text)
+    if size is None:
+        raise argparse.ArgumentTypeError(f"неверный размер: {text} (нужно число больше нуля)")
+    return size
+
+
+def read_urls(paths):
+    """
+    Читает ссылки из файлов ('-' — стандартный ввод), см. validators.split_urls.
+    """
+    urls = []
+    for path in paths:
+        if path == '-':
+            urls += split_urls(sys.stdin.read())
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                urls += split_urls(f.read())
+    return urls
+
+
+def _add_download_options(parser):
+    """
+    Параметры загрузки, общие для команд download и work.
+    """
+    parser.add_argument("-o", "--output", default=os.path.join(os.getcwd(), "Downloaded_Audio"),
+                        help="папка для сохранения аудио (по умолчанию ./Downloaded_Audio)")
+    parser.add_argument("--staging-dir", metavar="DIR",
+                        help="рабочая папка на быстром локальном диске: скачивание и перекодирование идут в ней, "
+                             "а в папку -o переносится только готовый трек")
+    parser.add_argument("--http-chunk-size", type=parse_size, metavar="SIZE",
+                        help="запрашивать файл фрагментами этого размера, например 10M")
+    parser.add_argument("--buffer-size", type=parse_size, metavar="SIZE",
+                        help="размер буфера чтения при скачивании, например 64K")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="количество параллельных загрузок (по умолчанию 1)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="подбирать число одновременных загрузок по скорости и ошибкам "
+                             "(--jobs задаёт верхнюю границу)")
+    parser.add_argument("--limit-rate", type=parse_rate, metavar="RATE",
+                        help="общий лимит скорости всех загрузок, например 500K или 2M (байт/с)")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="повторов после временных ошибок сети (по умолчанию 3)")
+    parser.add_argument("--transcode-workers", type=int, default=os.cpu_count() or 1,
+                        help="количество параллельных процессов ffmpeg (по умолчанию — число ядер)")
+    parser.add_argument("-m", "--metadata", action="store_true",
+                        help="добавлять метаданные и обложку")
+    parser.add_argument("--cover-size", type=int, default=DEFAULT_COVER_SIZE,
+                        help=f"максимальная сторона обложки в пикселях (по умолчанию {DEFAULT_COVER_SIZE})")
+    parser.add_argument("--native", action="store_true",
+                        help="сохранять исходный кодек без перекодирования в MP3")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="периодически записывать метрики (прогресс, скорость, ETA, время этапов) в файл")
+    parser.add_argument("--metrics-format", choices=(METRICS_JSON, METRICS_PROMETHEUS), default=METRICS_JSON,
+                        help="формат файла метрик (по умолчанию json)")
+    parser.add_argument("--metrics-interval", type=float, default=5.0,
+                        help="интервал записи метрик в секундах (по умолчанию 5)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="YouTubeAudioDownloader",
+        description="Скачивание аудио с YouTube без графического интерфейса. "
+                    "Без аргументов запускается окно приложения.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    download = subparsers.add_parser(
+        "download",
+        help="скачать ссылки, печатая события в формате JSON Lines",
+    )
+    download.add_argument("urls", nargs="*", metavar="URL", help="ссылки на видео или плейлисты")
+    download.add_argument("-i", "--input", action="append", default=[], metavar="FILE",
+                          help="файл со ссылками, по одной на строку ('-' — стандартный ввод); можно повторять")
+    _add_download_options(download)
+    download.set_defaults(handler=run_download)
+
+    serve = subparsers.add_parser(
+        "serve",
+        help="координатор: раздавать ссылки исполнителям (команда work) по HTTP",
+    )
+    serve.add_argument("urls", nargs="*", metavar="URL", help="ссылки на видео или плейлисты")
+    serve.add_argument("-i", "--input", action="append", default=[], metavar="FILE",
+                       help="файл со ссылками, по одной на строку ('-' — стандартный ввод); можно повторять")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="адрес сервера (по умолчанию только локальный; 0.0.0.0 — для исполнителей "
+                            "на других машинах, аутентификации нет)")
+    serve.add_argument("--port", type=int,
+                       help="порт сервера (по умолчанию 8765)")
+    serve.add_argument("--journal", metavar="PATH",
+                       help="файл, в котором очередь сохраняется между перезапусками координатора")
+    serve.add_argument("--lease-seconds", type=float,
+                       help="через сколько секунд без сигнала от исполнителя задача возвращается в очередь "
+                            "(по умолчанию 60)")
+    serve.add_argument("--max-attempts", type=int,
+                       help="сколько раз выдавать неудачную задачу (по умолчанию 3)")
+    serve.add_argument("--exit-when-done", action="store_true",
+                       help="завершиться, когда все задачи выполнены (без ссылок в аргументах — "
+                            "после выполнения задач, добавленных через POST /jobs)")
+    serve.set_defaults(handler=run_serve)
+
+    work = subparsers.add_parser(
+        "work",
+        help="исполнитель: брать ссылки у координатора (команда serve) и скачивать их",
+    )
+    work.add_argument("--server",
+                      help="адрес координатора (по умолчанию http://127.0.0.1:8765)")
+    work.add_argument("--name",
+                      help="имя исполнителя (по умолчанию хост-PID). С постоянным именем "
+                           "исполнитель после перезапуска продолжает прерванные треки")
+    work.add_argument("--exit-when-done", action="store_true",
+                      help="завершиться, когда у координатора не останется задач")
+    _add_download_options(work)
+    work.set_defaults(handler=run_work)
+    return parser
+
+
+def _check_download_options(args, parser):
+    if args.jobs < 1 or args.transcode_workers < 1:
+        parser.error("количество потоков должно быть не меньше 1")
+    if args.retries < 0:
+        parser.error("количество повторов не может быть отрицательным")
+
+
+def _collect_urls(args, parser, reporter):
+    """
+    Ссылки из аргументов и файлов в каноническом виде, без повторов.
+    Некорректные ссылки выводятся событиями error.
+    """
+    urls = list(args.urls)
+    try:
+        urls += read_urls(args.input)
+    except OSError as e:
+        parser.error(f"не удалось прочитать список ссылок: {e}")
+
+    # Ссылки приводятся к единому виду, поэтому разные записи одного видео скачиваются один раз
+    valid_urls = {}
+    for url in urls:
+        canonical = canonical_youtube_url(url)
+        if canonical is not None:
+            valid_urls[canonical] = None
+        else:
+            reporter.emit('error', {'stage': 'queue', 'id': url, 'message': "Ссылка не является ссылкой на YouTube"})
+    return list(valid_urls)
+
+
+def _configure_downloader(downloader, args):
+    downloader.quiet = True  # stdout занят событиями JSON Lines
+    downloader.with_metadata = args.metadata
+    downloader.cover_max_size = args.cover_size
+    downloader.output_format = OUTPUT_NATIVE if args.native else OUTPUT_MP3
+    downloader.staging_folder = args.staging_dir
+    downloader.http_chunk_size = args.http_chunk_size
+    downloader.buffer_size = args.buffer_size
+    downloader.max_workers = args.jobs
+    downloader.transcode_workers = args.transcode_workers
+    downloader.adaptive_concurrency = args.adaptive
+    downloader.rate_limiter.rate = args.limit_rate
+    downloader.retry_policy.retries = args.retries
+    downloader.metrics_path = args.metrics_file
+    downloader.metrics_format = args.metrics_format
+    downloader.metrics_interval = args.metrics_interval
+
+
+def run_download(args, parser):
+    _check_download_options(args, parser)
+
+    reporter = JsonLinesReporter(sys.stdout)
+    valid_urls = _collect_urls(args, parser, reporter)
+    if not valid_urls:
+        reporter.emit('done', {'total': 0, 'completed': 0, 'failed': reporter.errors, 'stopped': False})
+        return EXIT_FAILED if reporter.errors else EXIT_OK
+
+    downloader = Downloader(
+        download_folder=args.output,
+        log_callback=reporter.log,
+        progress_callback=reporter.progress,
+        staging_folder=args.staging_dir,
+    )
+    if not downloader._ffmpeg_available():
+        reporter.emit('error', {'stage': 'startup', 'message': "ffmpeg не найден. Установите ffmpeg для продолжения."})
+        return EXIT_NO_FFMPEG
+
+    downloader.event_callback = reporter.emit
+    _configure_downloader(downloader, args)
+
+    downloader.start_download(valid_urls, lambda: None)
+    try:
+        # join с таймаутом, чтобы Ctrl+C прерывал ожидание
+        while downloader.thread.is_alive():
+            downloader.thread.join(0.2)
+    except KeyboardInterrupt:
+        downloader.stop_download()
+        downloader.thread.join()
+        return EXIT_INTERRUPTED
+
+    return EXIT_FAILED if reporter.errors else EXIT_OK
+
+
+def run_serve(args, parser):
+    # Сервер задач нужен только этой команде: http.server и urllib не замедляют запуск остальных
+    from jobserver import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_PORT, JobQueue, JobServer
+
+    if args.port is None:
+        args.port = DEFAULT_PORT
+    if args.lease_seconds is None:
+        args.lease_seconds = DEFAULT_LEASE_SECONDS
+    if args.max_attempts is None:
+        args.max_attempts = DEFAULT_MAX_ATTEMPTS
+    if args.lease_seconds <= 0 or args.max_attempts < 1:
+        parser.error("время аренды должно быть больше нуля, а число попыток — не меньше 1")
+
+    reporter = JsonLinesReporter(sys.stdout)
+    urls = _collect_urls(args, parser, reporter)
+    journal = JobJournal(args.journal) if args.journal else None
+    if journal is not None:
+        journal.compact()
+    jobs = JobQueue(
+        lease_seconds=args.lease_seconds,
+        max_attempts=args.max_attempts,
+        journal=journal,
+        event_callback=reporter.emit,
+    )
+    jobs.add(urls)
+    try:
+        server = JobServer(jobs, host=args.host, port=args.port)
+    except OSError as e:
+        reporter.emit('error', {'stage': 'startup', 'message': f"Не удалось запустить сервер задач: {e}"})
+        return EXIT_FAILED
+    server.start()
+    reporter.emit('serving', {'address': server.address, **jobs.stats()})
+
+    code = EXIT_OK
+    try:
+        while not (args.exit_when_done and jobs.is_finished()):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        code = EXIT_INTERRUPTED
+    server.stop()
+    if journal is not None:
+        journal.close()
+    stats = jobs.stats()
+    reporter.emit('done', stats)
+    if code == EXIT_OK and stats['failed']:
+        code = EXIT_FAILED
+    return code
+
+
+def run_work(args, parser):
+    from jobserver import DEFAULT_PORT, JobClient
+    from worker import JobWorker, default_worker_name
+
+    _check_download_options(args, parser)
+
+    reporter = JsonLinesReporter(sys.stdout)
+    name = args.name or default_worker_name()
+    # У каждого исполнителя свой журнал: несколько процессов могут писать в одну папку.
+    # Журнал лежит в рабочей папке, как и журнал Downloader по умолчанию
+    work_folder = os.path.join(args.staging_dir, STAGING_DIRNAME) if args.staging_dir else args.output
+    os.makedirs(work_folder, exist_ok=True)
+    journal_path = os.path.join(work_folder, f".job_journal.{sanitize_filename(name)}.jsonl")
+    downloader = Downloader(
+        download_folder=args.output,
+        log_callback=reporter.log,
+        progress_callback=reporter.progress,
+        journal_path=journal_path,
+        staging_folder=args.staging_dir,
+    )
+    if not downloader._ffmpeg_available():
+        reporter.emit('error', {'stage': 'startup', 'message': "ffmpeg не найден. Установите ffmpeg для продолжения."})
+        return EXIT_NO_FFMPEG
+
+    downloader.event_callback = reporter.emit
+    _configure_downloader(downloader, args)
+    server_url = args.server or f"http://127.0.0.1:{DEFAULT_PORT}"
+    worker = JobWorker(JobClient(server_url), downloader, name, event_callback=reporter.emit)
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(failed=worker.run(args.exit_when_done)))
+    thread.start()
+    code = EXIT_OK
+    try:
+        # join с таймаутом, чтобы Ctrl+C прерывал ожидание
+        while thread.is_alive():
+            thread.join(0.2)
+    except KeyboardInterrupt:
+        # Текущая задача возвращается координатору и достанется другому исполнителю
+        worker.stop()
+        thread.join()
+        code = EXIT_INTERRUPTED
+
+    downloader.journal.close()
+    if not downloader.journal.jobs():
+        # Продолжать нечего — журнал этого исполнителя больше не нужен
+        os.remove(journal_path)
+    if code == EXIT_OK and result.get('failed'):
+        code = EXIT_FAILED
+    return code
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    return args.handler(args, parser)
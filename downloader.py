@@ -1,59 +1,251 @@
 import os
-import sys
+import subprocess
 import threading
-import yt_dlp
-from shutil import which
-from metadata import add_metadata, convert_thumbnail
+import time
+from archive import ARCHIVE_FILENAME, DownloadArchive
+from cache import INFO_CACHE_DIRNAME, InfoCache
+from journal import JOURNAL_FILENAME, STAGE_DOWNLOADED, STAGE_TAGGED, STAGE_TRANSCODED, JobJournal
+from metadata import (
+    DEFAULT_COVER_SIZE, METADATA_ADDED, add_metadata, convert_thumbnail, ffmpeg_tag_args, write_mp4_video_id,
+)
+from pipeline import Pipeline, Stage, worker_index
+from progress import METRICS_JSON, MetricsExporter, ProgressTracker
+from sessions import SessionPool
+from staging import INCOMPLETE_SUFFIX, STAGING_DIRNAME, cleanup_stale_files, finalize_file
+from scheduler import (
+    ERROR_PERMANENT,
+    ERROR_THROTTLED,
+    ConcurrencyController,
+    DownloadCancelled,
+    RateLimiter,
+    RetryPolicy,
+    classify_error,
+)
+from tools import find_ffmpeg
+from validators import extract_video_id
+
+
+# Типы записей yt_dlp, которые соответствуют одному треку
+_TRACK_RESULT_TYPES = ('video', 'url', 'url_transparent')
+# Результаты-ссылки, которые экстрактор возвращает вместо содержимого (перенаправления)
+_URL_RESULT_TYPES = ('url', 'url_transparent')
+# Сколько перенаправлений верхнего уровня проходится при раскрытии одной ссылки
+MAX_URL_REDIRECTS = 5
+
+
+def _is_cancellation(error):
+    """
+    True, если ошибка — остановка скачивания (DownloadCancelled yt_dlp, в том числе
+    завёрнутая в другое исключение), а не сбой сети или трека.
+    """
+    import yt_dlp
+
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, yt_dlp.utils.DownloadCancelled):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Режимы выходного формата: перекодирование в MP3 или исходный кодек без перекодирования
+OUTPUT_MP3 = 'mp3'
+OUTPUT_NATIVE = 'native'
+
+# Контейнер для исходного кодека в режиме OUTPUT_NATIVE (ключ — начало строки acodec).
+# Кодеков, которых здесь нет, режим не поддерживает — они перекодируются в MP3.
+_NATIVE_EXTENSIONS = {
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'mp4a': 'm4a',
+    'aac': 'm4a',
+    'mp3': 'mp3',
+    'flac': 'flac',
+}
+
+# Поля словаря yt_dlp, которые сохраняются в журнале задач: их достаточно,
+# чтобы после перезапуска перекодировать скачанный файл и записать теги
+_JOURNAL_INFO_FIELDS = (
+    'id', 'title', 'uploader', 'playlist', 'playlist_id', 'playlist_title',
+    'playlist_index', 'acodec', 'ext', 'thumbnail', 'webpage_url',
+)
+
+# Собственные повторы yt_dlp отключены: они идут подряд без пауз (4 запроса страницы
+# и 4 запроса API на одну попытку), а повторами с задержкой и разбросом управляет RetryPolicy
+_NO_YTDLP_RETRIES = {
+    'retries': 0,
+    'fragment_retries': 0,
+    'extractor_retries': 0,
+}
+
+# Опции yt_dlp для быстрого раскрытия ссылок без скачивания
+_EXPAND_OPTIONS = {
+    **_NO_YTDLP_RETRIES,
+    'extract_flat': 'in_playlist',
+    'quiet': True,
+    'no_warnings': True,
+    'no_color': True,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36'
+    },
+}
+
+
+class Track:
+    def __init__(self, url, info, playlist=None):
+        """
+        Один трек, проходящий через этапы конвейера.
+        :param url: Исходная ссылка из очереди (видео или плейлист).
+        :param info: Словарь с информацией о треке от yt_dlp. До скачивания это
+                     «плоская» запись плейлиста или необработанный результат экстрактора.
+        :param playlist: Поля плейлиста (playlist_title, playlist_index и т.д.),
+                         которые передаются в yt_dlp при скачивании записи.
+        """
+        self.url = url
+        self.info = info
+        self.playlist = playlist or {}
+        self.source_path = None  # Скачанный файл до перекодирования
+        self.output_path = None  # Итоговый аудиофайл
+        self.thumbnail_data = None  # Байты миниатюры, скачанной в память
+        self.cover_data = None  # Обложка в JPEG, готовая к встраиванию
+        self.tags_embedded = False  # Теги и обложка записаны ffmpeg при перекодировании
+        # Последний завершённый этап: STAGE_DOWNLOADED или STAGE_TRANSCODED,
+        # если трек восстановлен из журнала задач, иначе None
+        self.stage = None
+
+    @property
+    def key(self):
+        """
+        Ключ для удаления дубликатов: ID видео, а если его нет — ссылка.
+        """
+        return self.info.get('id') or self.info.get('url') or self.url
+
+    @property
+    def title(self):
+        return self.info.get('title') or self.info.get('url') or self.url
 
 
 class Downloader:
-    def __init__(self, download_folder, log_callback, progress_callback):
+    def __init__(self, download_folder, log_callback, progress_callback, journal_path=None, staging_folder=None):
         """
         Класс, отвечающий за скачивание аудио с YouTube.
         :param download_folder: Папка для сохранения аудио.
         :param log_callback: Функция для логирования сообщений.
         :param progress_callback: Функция для обновления прогресса (принимает значение процента).
+        :param journal_path: Путь к журналу задач (по умолчанию JOURNAL_FILENAME в рабочей папке).
+                             Процессам, которые пишут в одну папку, нужны разные журналы.
+        :param staging_folder: Рабочая папка на быстром локальном диске (см. self.staging_folder).
+                               Задаётся при создании, потому что в ней же хранится журнал.
         """
         self.download_folder = download_folder
         os.makedirs(self.download_folder, exist_ok=True)
         self.log_callback = log_callback
         self.progress_callback = progress_callback
+        # Необязательный обработчик структурированных событий: event_callback(event, fields).
+        # События: queued, skipped, progress, stage, retry, concurrency, error, done.
+        self.event_callback = None
         self.stop_event = threading.Event()
         self.thread = None
         self.with_metadata = False  # По умолчанию метаданные не добавляются
+        self.cover_max_size = DEFAULT_COVER_SIZE  # Максимальная сторона встраиваемой обложки
+        self.output_format = OUTPUT_MP3  # OUTPUT_NATIVE — сохранять исходный кодек без перекодирования
+        self.quiet = False  # Не печатать вывод yt-dlp в stdout (режим командной строки)
+        # Рабочая папка на быстром локальном диске (None — работать прямо в папке загрузок).
+        # Файлы .part, миниатюры и перекодирование остаются в ней, а в библиотеку
+        # готовый трек переносится одним атомарным перемещением.
+        self.staging_folder = staging_folder
+        # Размер фрагмента, которым запрашивается файл (http_chunk_size yt-dlp, байт;
+        # None — весь файл одним запросом) и буфер чтения при скачивании (байт; None — по умолчанию)
+        self.http_chunk_size = None
+        self.buffer_size = None
+        self._stale_files_checked = False  # Очистка выполняется один раз за время жизни объекта
 
-        # Определяем путь к ffmpeg в папке bin проекта.
-        # Если приложение запущено из собранного exe (PyInstaller), используем sys._MEIPASS.
-        if hasattr(sys, '_MEIPASS'):
-            base_dir = os.path.join(sys._MEIPASS, 'bin')
-        else:
-            base_dir = os.path.join(os.path.dirname(__file__), 'bin')
+        # Индекс уже скачанных видео: позволяет пропускать их до любых сетевых запросов
+        self.archive = DownloadArchive(
+            os.path.join(self.download_folder, ARCHIVE_FILENAME),
+            library_folder=self.download_folder,
+        )
+        # Кэш результатов извлечения: повторы и повторно добавленные ссылки
+        # не запрашивают страницу видео заново. Папка дискового уровня зависит
+        # от staging_folder, поэтому выбирается в начале загрузки (см. _download_all)
+        self.info_cache = InfoCache()
+        # Журнал этапов каждого трека и очереди ссылок: после сбоя или перезапуска
+        # уже выполненные этапы не повторяются. Журнал пишется на каждом этапе, поэтому
+        # он в рабочей папке: с staging_folder медленного диска касаются только готовые треки
+        if journal_path is None:
+            os.makedirs(self.work_folder, exist_ok=True)
+            journal_path = os.path.join(self.work_folder, JOURNAL_FILENAME)
+        self.journal = JobJournal(journal_path)
+        # Размеры пулов потоков для этапов конвейера:
+        # сеть, перекодирование ffmpeg (по числу ядер) и запись тегов.
+        self.max_workers = 1
+        self.transcode_workers = os.cpu_count() or 1
+        self.tag_workers = 1
+        # Подбирать число одновременных загрузок по скорости и ошибкам;
+        # max_workers в этом режиме — верхняя граница
+        self.adaptive_concurrency = False
+        self.concurrency = ConcurrencyController(1)
+        # Общий лимит скорости всех загрузок (rate_limiter.rate, байт/с; None — без лимита)
+        self.rate_limiter = RateLimiter()
+        # Повторы после временных ошибок сети и ограничения частоты запросов
+        self.retry_policy = RetryPolicy()
+        # Долгоживущие экземпляры YoutubeDL, по одному на рабочий поток:
+        # соединения и экстракторы переиспользуются между треками
+        self._expand_sessions = SessionPool(self._expand_options)
+        self._download_sessions = SessionPool(self._download_options)
 
-        bin_ffmpeg = os.path.join(base_dir, 'ffmpeg.exe')
-        bin_ffprobe = os.path.join(base_dir, 'ffprobe.exe')
+        # Состояние текущего пакета загрузок, общее для всех рабочих потоков
+        self._lock = threading.Lock()
+        self._running = False  # Пакет запущен и ещё не завершился (см. start_download)
+        self._seen_keys = set()
+        self._playlists = {}  # ссылка -> поля плейлиста для записей, раскрытых в другом месте
+        # Прогресс по байтам, скорость, ETA и время этапов текущего пакета
+        self.tracker = ProgressTracker()
 
-        if os.path.exists(bin_ffmpeg) and os.path.exists(bin_ffprobe):
-            self.ffmpeg_path = bin_ffmpeg
-            self.ffprobe_path = bin_ffprobe
+        # Файл метрик, который периодически перезаписывается во время загрузки
+        # (None — не записывать), его формат (METRICS_JSON или METRICS_PROMETHEUS) и интервал
+        self.metrics_path = None
+        self.metrics_format = METRICS_JSON
+        self.metrics_interval = 5.0
+
+        # Путь к ffmpeg: папка bin проекта (или sys._MEIPASS в собранном exe), затем PATH.
+        # Результат поиска кэшируется, см. tools.find_ffmpeg.
+        self.ffmpeg_path, self.ffprobe_path, source = find_ffmpeg()
+        if source == 'bin':
             self.log_callback(f"ffmpeg найден в папке bin: {self.ffmpeg_path}")
+        elif source == 'path':
+            self.log_callback(f"ffmpeg найден в PATH: {self.ffmpeg_path}")
         else:
-            # Если ffmpeg не найден в bin, ищем в системном PATH
-            self.ffmpeg_path = which("ffmpeg")
-            self.ffprobe_path = which("ffprobe")
-            if self.ffmpeg_path:
-                self.log_callback(f"ffmpeg найден в PATH: {self.ffmpeg_path}")
-            else:
-                self.log_callback("ffmpeg не найден ни в папке bin, ни в PATH.")
+            self.log_callback("ffmpeg не найден ни в папке bin, ни в PATH.")
 
-    def start_download(self, url_list, completion_callback):
+    def start_download(self, url_list, completion_callback, playlists=None):
         """
         Запускает загрузку в отдельном потоке.
         :param url_list: Список ссылок для загрузки.
         :param completion_callback: Функция, вызываемая по завершении всех загрузок.
+        :param playlists: Необязательный словарь ссылка -> поля плейлиста (playlist_title,
+                          playlist_index и т.д.) для ссылок на видео, которые являются
+                          записями плейлиста, раскрытого заранее (см. list_entries).
+        :return: False, если предыдущий пакет ещё выполняется (в том числе дорабатывает
+                 после остановки) и новый не запущен.
         """
+        with self._lock:
+            if self._running:
+                self.log_callback("Предыдущая загрузка ещё не завершена.")
+                return False
+            self._running = True
         self.stop_event.clear()
-        self.thread = threading.Thread(target=self._download_all, args=(url_list, completion_callback))
+        self.thread = threading.Thread(target=self._run_batch, args=(url_list, completion_callback, playlists))
         self.thread.start()
+        return True
+
+    def is_running(self):
+        """
+        True, пока пакет загрузок выполняется или дорабатывает после остановки.
+        """
+        with self._lock:
+            return self._running
 
     def stop_download(self):
         """
@@ -61,114 +253,827 @@ class Downloader:
         """
         self.stop_event.set()
 
-    def _download_all(self, url_list, completion_callback):
-        total = len(url_list)
-        for idx, url in enumerate(url_list):
+    def close_sessions(self):
+        """
+        Закрывает экземпляры YoutubeDL и их соединения. После пакетной загрузки
+        это происходит само; при вызовах download_audio — по усмотрению вызывающего.
+        """
+        self._expand_sessions.close()
+        self._download_sessions.close()
+
+    def _run_batch(self, url_list, completion_callback, playlists=None):
+        try:
+            self._download_all(url_list, playlists)
+        finally:
+            # Флаг снимается до обратного вызова: из него уже можно запустить следующий пакет
+            with self._lock:
+                self._running = False
+            completion_callback()
+
+    def prepare_archive(self):
+        """
+        Запускает отложенную пересборку индекса скачанного в фоновом потоке,
+        чтобы она не задерживала ни окно, ни начало первой загрузки.
+        """
+        if not self.archive.is_ready():
+            threading.Thread(
+                target=self.archive.ensure_ready,
+                args=(self.log_callback,),
+                name='archive-rebuild',
+                daemon=True,
+            ).start()
+
+    def _download_all(self, url_list, playlists=None):
+        """
+        Пропускает ссылки через конвейер:
+        раскрытие плейлистов -> скачивание -> перекодирование -> теги.
+        У каждого этапа свой пул потоков и ограниченная очередь, поэтому
+        ffmpeg перекодирует один трек, пока скачивается следующий.
+        """
+        if not self._stale_files_checked:
+            self._stale_files_checked = True
+            # Сжатие журнала и очистка — здесь, в потоке загрузки, а не при запуске программы
+            self.journal.compact()
+            self._cleanup_stale_files()
+        # Новый индекс скачанного пересобирается здесь, в потоке загрузки, с сообщениями о ходе
+        self.archive.ensure_ready(self.log_callback)
+        # Дисковый кэш метаданных — в рабочей папке: с staging_folder это быстрый локальный диск
+        cache_dir = os.path.join(self.work_folder, INFO_CACHE_DIRNAME)
+        if self.info_cache.cache_dir != cache_dir:
+            self.info_cache = InfoCache(cache_dir=cache_dir)
+        # Пока плейлисты не раскрыты, каждая ссылка считается одним треком
+        self.tracker.reset(len(url_list))
+        with self._lock:
+            self._seen_keys = set()
+        self._playlists = playlists or {}
+        self.concurrency = ConcurrencyController(
+            self.max_workers,
+            adaptive=self.adaptive_concurrency,
+            on_change=self._concurrency_changed,
+        )
+
+        exporter = None
+        if self.metrics_path:
+            exporter = MetricsExporter(
+                self.tracker,
+                self.metrics_path,
+                self.metrics_format,
+                self.metrics_interval,
+                log_callback=self.log_callback,
+            )
+            exporter.start()
+
+        pipeline = Pipeline(
+            [
+                Stage("expand", self._expand_stage, workers=self.max_workers),
+                Stage("download", self._download_stage, workers=self.max_workers),
+                Stage("transcode", self._transcode_stage, workers=self.transcode_workers),
+                Stage("tag", self._tag_stage, workers=self.tag_workers),
+            ],
+            stop_event=self.stop_event,
+            error_callback=self._stage_failed,
+            drop_callback=lambda item: None,
+        )
+        pipeline.run(url_list)
+        # Потоки конвейера завершились — их соединения больше не нужны
+        self.close_sessions()
+        if exporter is not None:
+            exporter.stop()
+
+        if self.stop_event.is_set():
+            self.log_callback("Загрузка остановлена пользователем.")
+        stats = self.info_cache.stats()
+        self.log_callback(f"Кэш метаданных: попаданий {stats['hits']}, промахов {stats['misses']}.")
+        snapshot = self.tracker.snapshot()
+        self._emit(
+            'done',
+            stopped=self.stop_event.is_set(),
+            total=snapshot['total'],
+            completed=snapshot['completed'],
+            failed=snapshot['failed'],
+            downloaded_bytes=snapshot['downloaded_bytes'],
+            elapsed_seconds=round(snapshot['elapsed_seconds'], 3),
+            stages=snapshot['stages'],
+        )
+
+    def _expand_stage(self, url):
+        """
+        Раскрывает ссылку в отдельные треки и отдаёт их следующему этапу по одному,
+        пропуская записи, которые уже встречались в этом пакете.
+        """
+        self.log_callback(f"{self._prefix()}Обработка ссылки: {url}")
+        count = 0
+        failed = False
+        try:
+            for track in self._admit(url, self._expand(url)):
+                count += 1
+                yield track
+        except DownloadCancelled:
+            pass
+        except Exception as e:
+            failed = True
+            self._record_failure('expand', url, e)
+        finally:
+            if not count:
+                if not failed and not self.stop_event.is_set():
+                    self.log_callback(f"Не найдено ни одной новой записи: {url}")
+                self._track_finished()
+            else:
+                self._report_progress()
+
+    def _admit(self, url, tracks):
+        """
+        Пропускает треки, которые уже встречались в этом пакете, и учитывает остальные
+        в прогрессе. Ссылка (или запись, оказавшаяся плейлистом) уже учтена как один трек,
+        поэтому первый трек занимает её место, а каждый следующий добавляет ещё один.
+        """
+        count = 0
+        for track in tracks:
             if self.stop_event.is_set():
-                self.log_callback("Загрузка остановлена пользователем.")
                 break
+            with self._lock:
+                duplicate = track.key in self._seen_keys
+                self._seen_keys.add(track.key)
+            if duplicate:
+                self.log_callback(f"Пропущен дубликат: {track.title}")
+                continue
+            if count:
+                self.tracker.add_tracks(1)
+            count += 1
+            if track.playlist:
+                self.log_callback(f"Добавлена запись {count}: {track.title}")
+            self._emit('queued', url=url, id=track.key, title=track.title)
+            yield track
+
+    def _download_stage(self, track):
+        started = None
+
+        def fetch():
+            # Время этапа считаем с первой попытки, без ожидания свободного места
+            nonlocal started
+            started = started or time.monotonic()
+            return self._fetch(track)
+
+        container = self._retrying(track.key, fetch)
+        if container is not None:
+            return self._download_nested(track, container)
+        self._stage_done('download', track, started, title=track.title)
+        return [track]
+
+    def _download_nested(self, track, info):
+        """
+        Запись плейлиста оказалась плейлистом (вкладка «Плейлисты» канала, полка
+        исполнителя YouTube Music): раскрывает её и скачивает записи по одной.
+        Передать такую запись в process_ie_result значило бы скачать весь вложенный
+        плейлист как один трек, без перекодирования и тегов.
+        """
+        self.log_callback(f"{self._prefix()}Запись оказалась плейлистом, раскрываем: {track.title}")
+        count = 0
+        try:
+            for entry in self._admit(track.url, self._tracks_to_download(track.url, info)):
+                count += 1
+                try:
+                    downloaded = list(self._download_stage(entry))
+                except Exception as e:
+                    self._item_failed('download', entry, e)
+                    continue
+                yield from downloaded
+        except DownloadCancelled:
+            pass
+        except Exception as e:
+            self._record_failure('expand', track.key, e)
+        finally:
+            if not count:
+                self._track_finished(track.key)
+
+    def _transcode_stage(self, track):
+        started = time.monotonic()
+        self._transcode(track)
+        self._stage_done('transcode', track, started, path=track.output_path)
+        return [track]
+
+    def _tag_stage(self, track):
+        started = time.monotonic()
+        self.log_callback(self._process_single_entry(track))
+        self._stage_done('tag', track, started, path=track.output_path)
+        self._track_finished(track.key)
+
+    def _stage_done(self, stage_name, track, started, **fields):
+        seconds = time.monotonic() - started
+        self.tracker.record_stage(stage_name, seconds)
+        self._emit('stage', stage=stage_name, id=track.key, seconds=round(seconds, 3), **fields)
+
+    def _stage_failed(self, stage, item, error):
+        self._item_failed(stage.name, item, error)
+
+    def _item_failed(self, stage_name, item, error):
+        key = item.key if isinstance(item, Track) else item
+        if not isinstance(error, DownloadCancelled):
+            self._record_failure(stage_name, key, error)
+        self._track_finished(key)
+
+    def _retrying(self, item_id, action, limited=True):
+        """
+        Выполняет action и возвращает её результат, повторяя после временных ошибок
+        с экспоненциальной задержкой и разбросом (см. RetryPolicy).
+        Если limited = True, каждая попытка занимает место в ограничителе
+        одновременных загрузок; на время ожидания перед повтором место освобождается.
+        """
+        attempt = 0
+        while True:
+            if limited and not self.concurrency.acquire(self.stop_event):
+                raise DownloadCancelled("Загрузка остановлена")
             try:
-                self.log_callback(f"Обработка ссылки: {url}")
-                result = self.download_audio(url)
-                self.log_callback(result)
+                result = action()
             except Exception as e:
-                self.log_callback(f"Ошибка: {e}")
+                if self.stop_event.is_set() or _is_cancellation(e):
+                    # Попытку прервала остановка (хук прогресса выбрасывает DownloadCancelled
+                    # yt_dlp) — это не ошибка трека и не повод снижать параллельность
+                    raise DownloadCancelled("Загрузка остановлена") from e
+                kind = classify_error(e)
+                self.concurrency.record_result(kind)
+                if kind == ERROR_PERMANENT or attempt >= self.retry_policy.retries:
+                    raise
+                delay = self.retry_policy.delay(attempt, throttled=kind == ERROR_THROTTLED)
+                attempt += 1
+                self.log_callback(
+                    f"{self._prefix()}Временная ошибка: {e}. "
+                    f"Повтор {attempt} из {self.retry_policy.retries} через {delay:.1f} с."
+                )
+                self._emit('retry', id=item_id, attempt=attempt, delay=round(delay, 1), message=str(e))
+            else:
+                self.concurrency.record_result()
+                return result
+            finally:
+                if limited:
+                    self.concurrency.release()
+            if self.stop_event.wait(delay):
+                raise DownloadCancelled("Загрузка остановлена")
 
-            progress = (idx + 1) / total * 100
-            self.progress_callback(progress)
+    def _concurrency_changed(self, limit):
+        self.log_callback(f"Одновременных загрузок: {limit}")
+        self._emit('concurrency', workers=limit)
 
-        completion_callback()
+    def _record_failure(self, stage_name, item_id, error):
+        self.log_callback(f"Ошибка: {error}")
+        self.tracker.record_failure()
+        self._emit('error', stage=stage_name, id=item_id, message=str(error))
+
+    def _emit(self, event, **fields):
+        """
+        Передаёт структурированное событие в event_callback, если он задан.
+        """
+        if self.event_callback is not None:
+            self.event_callback(event, fields)
+
+    def _track_finished(self, key=None):
+        self.tracker.track_finished(key)
+        self._report_progress()
+
+    def _prefix(self):
+        """
+        Префикс сообщений с номером потока загрузки, если потоков несколько.
+        """
+        index = worker_index()
+        if index is None or self.max_workers <= 1:
+            return ""
+        return f"[Поток {index}] "
+
+    def _report_progress(self):
+        """
+        Передаёт общий прогресс пакета, взвешенный по размеру файлов.
+        """
+        self.progress_callback(self.tracker.percent())
 
     def download_audio(self, url):
         """
-        Скачивает аудиофайл с YouTube.
+        Скачивает аудиофайл с YouTube и последовательно проводит его через все этапы.
         Если with_metadata = True, дополнительно внедряет метаданные (обложку, автора и т.д.).
         Возвращает строку с результатом.
         """
         if not self._ffmpeg_available():
             return "ffmpeg не найден. Установите ffmpeg для продолжения."
 
-        # Формируем базовые опции для yt-dlp
-        ydl_opts = {
+        result_messages = []
+        # Стек источников треков: запись, оказавшаяся плейлистом, раскрывается на месте
+        sources = [self._expand(url)]
+        while sources:
+            track = next(sources[-1], None)
+            if track is None:
+                sources.pop()
+                continue
+            try:
+                container = self._retrying(track.key, lambda: self._fetch(track))
+                if container is not None:
+                    sources.append(self._tracks_to_download(track.url, container))
+                    continue
+                self._transcode(track)
+                result_messages.append(self._process_single_entry(track))
+            except Exception as e:
+                result_messages.append(f"Ошибка: {e}")
+        return "\n".join(result_messages)
+
+    def _expand(self, url):
+        """
+        Быстро раскрывает ссылку без скачивания и по одной выдаёт объекты Track.
+        Для плейлиста используется «плоское» извлечение: записи содержат только ID,
+        ссылку и название, поэтому полный словарь плейлиста в памяти не хранится.
+        Видео, которые уже есть в индексе скачанного, пропускаются.
+        """
+        # Для ссылки на одно видео ID известен сразу — проверяем индекс без сети,
+        # а извлечение (или взятие из кэша) откладываем до этапа скачивания
+        video_id = extract_video_id(url)
+        if self._already_downloaded(video_id):
+            return
+        if video_id:
+            yield self._resume(Track(url, {'_type': 'url', 'url': url, 'id': video_id}, self._playlists.get(url)))
+            return
+        yield from self._tracks_to_download(url, self._extract_flat(url))
+
+    def list_entries(self, url):
+        """
+        Раскрывает ссылку без скачивания и возвращает её записи списком пар
+        (ссылка на запись, поля плейлиста), чтобы треки одного плейлиста можно было
+        раздать разным исполнителям (см. worker.JobWorker). Видео возвращается как есть.
+        """
+        return [
+            (track.info.get('webpage_url') or track.info.get('url') or url, track.playlist)
+            for track in self._iter_tracks(url, self._extract_flat(url))
+        ]
+
+    def _extract_flat(self, url):
+        """
+        «Плоское» извлечение ссылки с повторами и перенаправлениями верхнего уровня.
+        """
+        ydl = self._expand_sessions.get()
+        info_dict = self._retrying(
+            url,
+            lambda: ydl.extract_info(url, download=False, process=False),
+            limited=False,
+        )
+        info_dict = self._follow_redirects(ydl, url, info_dict)
+        if info_dict.get('_type', 'video') == 'video':
+            self.info_cache.put(info_dict.get('id'), ydl.sanitize_info(info_dict))
+        return info_dict
+
+    def _tracks_to_download(self, url, info_dict):
+        """
+        Треки результата извлечения без уже скачанных, восстановленные из журнала задач.
+        """
+        for track in self._iter_tracks(url, info_dict):
+            if self._already_downloaded(track.info.get('id')):
+                continue
+            yield self._resume(track)
+
+    def _follow_redirects(self, ydl, url, info_dict):
+        """
+        Проходит перенаправления верхнего уровня (результаты типа 'url'), пока не получится
+        видео или плейлист: вкладки и альбомы YouTube Music, канал -> загрузки и т.п.
+        Иначе плейлист за перенаправлением скачался бы целиком как один «трек».
+        """
+        for _ in range(MAX_URL_REDIRECTS):
+            if info_dict.get('_type') not in _URL_RESULT_TYPES:
+                break
+            current = info_dict
+            info_dict = self._retrying(url, lambda: self._redirect_step(ydl, current), limited=False)
+        return info_dict
+
+    @staticmethod
+    def _redirect_step(ydl, info_dict):
+        """
+        Извлекает цель одного результата-ссылки без обработки.
+        """
+        resolved = ydl.extract_info(info_dict['url'], download=False, process=False, ie_key=info_dict.get('ie_key'))
+        if info_dict['_type'] == 'url_transparent':
+            # Как и в yt_dlp: известные поля внешнего результата дополняют внутренний
+            resolved = dict(resolved, **{
+                key: value for key, value in info_dict.items()
+                if value is not None and key not in ('_type', 'url', 'ie_key')
+            })
+        return resolved
+
+    def _resume(self, track):
+        """
+        Восстанавливает трек из журнала задач, если в прошлый раз он был скачан
+        или перекодирован и файлы этого этапа на месте. Новый трек в журнал не пишется:
+        продолжать его нечего, а запись с fsync на каждую запись плейлиста задерживала бы начало.
+        """
+        job = self.journal.get(track.key)
+        info = job.get('info') if job else None
+        if info:
+            downloads = info.get('requested_downloads') or [{}]
+            if job['stage'] == STAGE_TRANSCODED and os.path.exists(job.get('output_path') or ''):
+                track.info = info
+                track.output_path = job['output_path']
+                track.tags_embedded = job.get('tags_embedded', False)
+                track.stage = STAGE_TRANSCODED
+            elif job['stage'] in (STAGE_DOWNLOADED, STAGE_TRANSCODED) \
+                    and os.path.exists(downloads[0].get('filepath') or ''):
+                track.info = info
+                track.stage = STAGE_DOWNLOADED
+        if track.stage is not None:
+            done = "перекодирован" if track.stage == STAGE_TRANSCODED else "скачан"
+            self.log_callback(f"Продолжение: трек уже {done} — {track.title}")
+        return track
+
+    @staticmethod
+    def _journal_info(info):
+        """
+        Сокращённый словарь для журнала задач (полный словарь yt_dlp слишком велик).
+        """
+        data = {name: info[name] for name in _JOURNAL_INFO_FIELDS if info.get(name) is not None}
+        data['thumbnails'] = [{'url': t['url']} for t in info.get('thumbnails') or [] if t.get('url')]
+        data['requested_downloads'] = [
+            {'filepath': d.get('filepath'), 'acodec': d.get('acodec'), 'container': d.get('container')}
+            for d in info.get('requested_downloads') or []
+        ]
+        return data
+
+    def _already_downloaded(self, video_id):
+        record = self.archive.get(video_id)
+        if record is None:
+            return False
+        self.log_callback(f"Уже скачано: {record['path']}")
+        self._emit('skipped', id=video_id, path=record['path'])
+        return True
+
+    def _iter_tracks(self, url, info_dict):
+        result_type = info_dict.get('_type', 'video')
+        if result_type in _TRACK_RESULT_TYPES:
+            yield Track(url, info_dict)
+            return
+        if result_type != 'playlist':
+            return
+
+        playlist = {
+            'playlist': info_dict.get('title') or info_dict.get('id'),
+            'playlist_id': info_dict.get('id'),
+            'playlist_title': info_dict.get('title'),
+            'playlist_uploader': info_dict.get('uploader'),
+        }
+        index = 0
+        for entry in info_dict.get('entries') or []:
+            if not entry:
+                continue
+            if entry.get('_type') == 'playlist':
+                # Вложенный плейлист (например, вкладки канала) раскрываем рекурсивно
+                yield from self._iter_tracks(url, entry)
+                continue
+            index += 1
+            yield Track(url, entry, dict(playlist, playlist_index=index))
+
+    def _fetch(self, track):
+        """
+        Этап сети: скачивает исходную аудиодорожку (и миниатюру) одного трека
+        без перекодирования и заменяет track.info полным словарем от yt_dlp.
+        Если запись оказалась не видео, а плейлистом, ничего не скачивает
+        и возвращает результат извлечения, чтобы его раскрыть (см. _download_nested).
+        """
+        if not self._ffmpeg_available():
+            raise RuntimeError("ffmpeg не найден. Установите ffmpeg для продолжения.")
+
+        import yt_dlp
+
+        ydl = self._download_sessions.get()
+        # Трек, скачанный до перезапуска, повторно не скачивается
+        if track.stage is None:
+            info, from_cache = self._resolve(ydl, track.info)
+            if info.get('_type', 'video') != 'video':
+                return info
+            try:
+                track.info = self._download_resolved(ydl, track, info)
+            except yt_dlp.utils.DownloadError:
+                if not from_cache:
+                    raise
+                # Ссылки на поток в кэше могли устареть раньше TTL — извлекаем заново
+                self.info_cache.invalidate(track.key)
+                info, _ = self._resolve(ydl, track.info)
+                track.info = self._download_resolved(ydl, track, info)
+            track.stage = STAGE_DOWNLOADED
+            self.journal.record(track.key, STAGE_DOWNLOADED, info=self._journal_info(track.info))
+
+        # Миниатюру скачиваем только если нужны метаданные, и сразу в память
+        if self.with_metadata and not track.tags_embedded:
+            track.thumbnail_data = self._fetch_thumbnail(ydl, track.info)
+
+    def _expand_options(self):
+        return dict(_EXPAND_OPTIONS)
+
+    def _download_options(self):
+        """
+        Опции экземпляров YoutubeDL этапа скачивания. Они одинаковы для всех треков:
+        поля плейлиста передаются при каждом вызове (extra_info), а хук прогресса
+        определяет трек по info_dict['id'], поэтому экземпляр переиспользуется без изменений.
+        """
+        options = {
             'format': 'bestaudio/best',
-            'outtmpl': os.path.join(self.download_folder, '%(playlist_title)s', '%(title)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+            'outtmpl': os.path.join(self.work_folder, '%(playlist_title)s', '%(title)s.%(ext)s'),
             'ffmpeg_location': self.ffmpeg_path,
             'no_color': True,
             'progress_hooks': [self._progress_hook],
+            'quiet': self.quiet,
+            'noprogress': self.quiet,
+            # Прерванная загрузка продолжается с файла .part
+            # (в том числе при повторе после временной ошибки, см. _retrying)
+            'continuedl': True,
+            **_NO_YTDLP_RETRIES,
+            # Исправления контейнера (например, m4a_dash -> m4a) делает проход ffmpeg
+            # этапа перекодирования: так файл после скачивания переписывается один раз
+            'fixup': 'never',
             # Добавляем HTTP-заголовки для имитации браузера
             'http_headers': {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36'
             },
         }
+        if self.http_chunk_size:
+            options['http_chunk_size'] = self.http_chunk_size
+        if self.buffer_size:
+            # Заданный размер не подстраивается yt-dlp по скорости
+            options['buffersize'] = self.buffer_size
+            options['noresizebuffer'] = True
+        return options
 
-        # Скачиваем thumbnail только если нужны метаданные
-        if self.with_metadata:
-            ydl_opts['writethumbnail'] = True
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=True)
-
-            # Проверяем, плейлист это или одиночное видео
-            if info_dict.get('_type') == 'playlist':
-                entries = info_dict.get('entries', [])
-                result_messages = []
-                for entry in entries:
-                    msg = self._process_single_entry(entry)
-                    result_messages.append(msg)
-                return "\n".join(result_messages)
-            else:
-                return self._process_single_entry(info_dict)
+    @property
+    def work_folder(self):
+        """
+        Папка, в которой скачиваются и обрабатываются треки до переноса в библиотеку.
+        """
+        if not self.staging_folder:
+            return self.download_folder
+        return os.path.join(self.staging_folder, STAGING_DIRNAME)
 
-    def _process_single_entry(self, info_dict):
+    def _finalize(self, track):
         """
-        Обрабатывает одну запись (один видео-трек).
-        Если with_metadata = True, добавляет метаданные и обложку.
+        Переносит готовый трек из рабочей папки в ту же подпапку библиотеки.
         """
-        downloads = info_dict.get('requested_downloads', [])
+        work_folder = os.path.abspath(self.work_folder)
+        output_path = os.path.abspath(track.output_path)
+        if work_folder == os.path.abspath(self.download_folder):
+            return
+        # Трек из журнала мог быть обработан с другой рабочей папкой или без неё
+        try:
+            in_work_folder = os.path.commonpath([work_folder, output_path]) == work_folder
+        except ValueError:
+            # Пути на разных дисках Windows: трек точно не в рабочей папке
+            in_work_folder = False
+        if not in_work_folder:
+            return
+        final_path = os.path.join(self.download_folder, os.path.relpath(output_path, work_folder))
+        finalize_file(output_path, final_path)
+        track.output_path = final_path
+        try:
+            # Папка плейлиста в рабочей папке больше не нужна, если она опустела
+            os.rmdir(os.path.dirname(output_path))
+        except OSError:
+            pass
+
+    def _cleanup_stale_files(self):
+        """
+        Удаляет незавершённые файлы прошлых запусков (см. staging.cleanup_stale_files),
+        кроме тех, с которых журнал задач продолжит работу. Если задана отдельная
+        рабочая папка, очищается только она (включая брошенные промежуточные файлы):
+        в библиотеку попадают лишь готовые треки, и обходить её, возможно на медленном
+        сетевом диске, незачем.
+        """
+        keep = {self.journal.path}
+        for job in self.journal.jobs().values():
+            keep.add(job.get('output_path'))
+            for download in (job.get('info') or {}).get('requested_downloads') or []:
+                keep.add(download.get('filepath'))
+        if self.work_folder == self.download_folder:
+            removed, removed_bytes = cleanup_stale_files(self.download_folder, keep=keep)
+        elif os.path.isdir(self.work_folder):
+            removed, removed_bytes = cleanup_stale_files(self.work_folder, keep=keep, partial_only=False)
+        else:
+            return
+        if removed:
+            self.log_callback(f"Удалено незавершённых файлов прошлых запусков: {removed} "
+                              f"({removed_bytes / 1024 / 1024:.1f} МБ)")
+
+    def _resolve(self, ydl, info):
+        """
+        Превращает «плоскую» запись плейлиста в результат экстрактора, проходя
+        перенаправления и используя кэш. Возвращает (info, взят_ли_результат_из_кэша).
+        """
+        if info.get('_type') not in _URL_RESULT_TYPES:
+            return info, False
+        video_id = info.get('id')
+        cached = self.info_cache.get(video_id)
+        if cached is not None:
+            return cached, True
+        resolved = info
+        for _ in range(MAX_URL_REDIRECTS):
+            if resolved.get('_type') not in _URL_RESULT_TYPES:
+                break
+            resolved = self._redirect_step(ydl, resolved)
+        if resolved.get('_type', 'video') == 'video':
+            self.info_cache.put(resolved.get('id') or video_id, ydl.sanitize_info(resolved))
+        return resolved, False
+
+    def _fetch_thumbnail(self, ydl, info):
+        """
+        Скачивает миниатюру в память. Предпочитает JPEG-вариант: его часто можно
+        встроить без перекодирования. Возвращает байты или None.
+        """
+        thumbnails = [t for t in info.get('thumbnails') or [] if t.get('url')]
+        # yt_dlp сортирует миниатюры от худшей к лучшей
+        jpeg_thumbnails = [t for t in thumbnails if t['url'].split('?')[0].lower().endswith(('.jpg', '.jpeg'))]
+        candidates = [t['url'] for t in reversed(jpeg_thumbnails or thumbnails)]
+        if info.get('thumbnail'):
+            candidates.append(info['thumbnail'])
+        for url in candidates:
+            try:
+                with ydl.urlopen(url) as response:
+                    return response.read()
+            except Exception:
+                continue
+        return None
+
+    def _download_resolved(self, ydl, track, info):
+        # Поля плейлиста передаются как extra_info: они попадают и в шаблон
+        # имени файла, и в итоговый словарь для тегов (playlist_title -> альбом)
+        return ydl.process_ie_result(info, download=True, extra_info=dict(track.playlist))
+
+    def _transcode(self, track):
+        """
+        Этап ffmpeg: перекодирует скачанную дорожку в MP3 192k и удаляет исходник.
+        В режиме OUTPUT_NATIVE исходный кодек сохраняется, меняется только контейнер;
+        перекодирование выполняется лишь для кодеков, которые режим не поддерживает.
+        M4A проходит через ffmpeg и без смены контейнера: yt-dlp не исправляет m4a_dash
+        (fixup: never), и в этом же проходе записываются теги.
+        """
+        if track.stage == STAGE_TRANSCODED:
+            return
+
+        downloads = track.info.get('requested_downloads', [])
         if not downloads:
-            return "Не удалось определить скачанный файл для одной из записей."
+            raise RuntimeError("Не удалось определить скачанный файл для одной из записей.")
 
-        downloaded_path = downloads[0]['filepath']
-        if not os.path.exists(downloaded_path):
-            return f"Файл не был скачан: {downloaded_path}"
+        source_path = downloads[0]['filepath']
+        if not os.path.exists(source_path):
+            raise RuntimeError(f"Файл не был скачан: {source_path}")
+        track.source_path = source_path
+
+        base_name, ext = os.path.splitext(source_path)
+        source_ext = self._native_extension(downloads[0].get('acodec') or track.info.get('acodec') or '')
+        target_ext = 'mp3'
+        if self.output_format == OUTPUT_NATIVE and source_ext:
+            target_ext = source_ext
 
+        in_place = ext.lower() == '.' + target_ext
+        remux = target_ext == 'm4a' and (self.with_metadata or downloads[0].get('container') == 'm4a_dash')
+        if in_place and not remux:
+            track.output_path = source_path
+            self._transcoded(track)
+            return
+
+        output_path = base_name + '.' + target_ext
+        # Без смены расширения ffmpeg пишет во временный файл, который затем заменяет исходник;
+        # формат указывается явно, потому что по расширению временного файла его не определить
+        write_path = output_path + INCOMPLETE_SUFFIX if in_place else output_path
+        format_args = ['-f', 'ipod'] if in_place else []
+        if source_ext == target_ext:
+            # Смена контейнера без перекодирования
+            codec_args = ['-codec:a', 'copy']
+        else:
+            codec_args = ['-codec:a', 'libmp3lame', '-b:a', '192k']
+
+        # Теги и обложка пишутся в этом же проходе ffmpeg, чтобы этапу тегов
+        # не пришлось переписывать готовый файл ещё раз
+        tag_args = None
         if self.with_metadata:
-            base_name, _ = os.path.splitext(downloaded_path)
-            webp_thumbnail = base_name + ".webp"
-            thumbnail_path = None
+            tag_args = ffmpeg_tag_args('.' + target_ext, track.info, self._cover_data(track))
+        input_args, output_args, stdin_data = tag_args or ([], ['-vn'], None)
+        command = [
+            self.ffmpeg_path, '-y', '-loglevel', 'error',
+            '-i', source_path,
+            *input_args,
+            *output_args, *codec_args, *format_args,
+            write_path,
+        ]
+        completed = subprocess.run(
+            command,
+            input=stdin_data,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            # Не показываем консольное окно ffmpeg в собранном exe под Windows
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+        )
+        if completed.returncode != 0:
+            if in_place and os.path.exists(write_path):
+                os.remove(write_path)
+            message = completed.stderr.decode('utf-8', errors='replace').strip()
+            raise RuntimeError(f"ffmpeg завершился с ошибкой для {source_path}: {message}")
+        if tag_args is not None and target_ext == 'm4a' and track.info.get('id'):
+            # ID видео — в место, зарезервированное этим проходом (см. ffmpeg_tag_args)
+            write_mp4_video_id(write_path, track.info['id'])
 
-            if os.path.exists(webp_thumbnail):
-                thumbnail_path = convert_thumbnail(webp_thumbnail)
+        track.output_path = output_path
+        track.tags_embedded = tag_args is not None
+        if in_place:
+            os.replace(write_path, output_path)
+            self._transcoded(track)
+            return
+        # Сначала отмечаем этап в журнале, затем удаляем исходник: при сбое между
+        # этими шагами останется лишний файл, но перекодирование не повторится
+        self._transcoded(track)
+        os.remove(source_path)
 
-            meta_result = add_metadata(downloaded_path, info_dict, thumbnail_path)
+    def _transcoded(self, track):
+        track.stage = STAGE_TRANSCODED
+        self.journal.record(
+            track.key, STAGE_TRANSCODED,
+            output_path=track.output_path, tags_embedded=track.tags_embedded,
+        )
+
+    def _cover_data(self, track):
+        """
+        Готовит обложку из скачанной миниатюры (один раз на трек) и освобождает исходные байты.
+        """
+        if track.thumbnail_data is not None:
+            # Обложка обрабатывается целиком в памяти: временные файлы не создаются
+            track.cover_data = convert_thumbnail(track.thumbnail_data, self.cover_max_size)
+            track.thumbnail_data = None
+        return track.cover_data
 
-            # Удаляем временные файлы миниатюр
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-            if os.path.exists(webp_thumbnail):
-                os.remove(webp_thumbnail)
+    @staticmethod
+    def _native_extension(acodec):
+        """
+        Возвращает расширение контейнера для исходного кодека или None.
+        """
+        acodec = acodec.lower()
+        for prefix, extension in _NATIVE_EXTENSIONS.items():
+            if acodec.startswith(prefix):
+                return extension
+        return None
 
-            return f"Готово: {downloaded_path}. {meta_result}"
+    def _process_single_entry(self, track):
+        """
+        Этап тегов: обрабатывает один перекодированный трек.
+        Если with_metadata = True, добавляет метаданные и обложку.
+        """
+        downloaded_path = track.output_path
+        if not downloaded_path or not os.path.exists(downloaded_path):
+            return f"Файл не был скачан: {downloaded_path}"
+
+        if self.with_metadata:
+            if track.tags_embedded:
+                meta_result = METADATA_ADDED
+            else:
+                # Формат, в который ffmpeg теги не пишет, или файл без прохода ffmpeg
+                meta_result = add_metadata(downloaded_path, track.info, self._cover_data(track))
+            track.cover_data = None
+
+        # Трек готов — переносим его из рабочей папки в библиотеку
+        self._finalize(track)
+        downloaded_path = track.output_path
+        if self.with_metadata:
+            message = f"Готово: {downloaded_path}. {meta_result}"
         else:
             # Если метаданные не нужны, возвращаем сообщение без встраивания обложки
-            return f"Готово: {downloaded_path} (без метаданных)"
+            message = f"Готово: {downloaded_path} (без метаданных)"
+
+        codec = os.path.splitext(downloaded_path)[1][1:].lower()
+        self.archive.record(track.info.get('id'), downloaded_path, codec=codec, tagged=self.with_metadata)
+        self.journal.record(track.key, STAGE_TAGGED)
+        track.stage = STAGE_TAGGED
+        return message
 
     def _progress_hook(self, d):
         """
         Хук для прогресса, вызывается yt_dlp.
         """
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        key = d.get('info_dict', {}).get('id')
+        total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+        downloaded_bytes = d.get('downloaded_bytes')
+        if d['status'] == 'finished':
+            downloaded_bytes = downloaded_bytes or total_bytes
+        counted = self.tracker.update_bytes(key, downloaded_bytes, total_bytes)
+        self.concurrency.record_bytes(counted)
+        # Общий лимит скорости: поток скачивания ждёт здесь, пока его байты не «разрешены»
+        self.rate_limiter.consume(counted, self.stop_event)
+        self._report_progress()
+        if d['status'] == 'downloading' and self.stop_event.is_set():
+            # Прерываем скачивание сразу, а не по окончании файла; .part остаётся для докачки
+            import yt_dlp
+            raise yt_dlp.utils.DownloadCancelled("Загрузка остановлена")
+
         if d['status'] == 'downloading':
             p_str = d.get('_percent_str', '0%').strip()
             try:
                 p_val = float(p_str.replace('%', ''))
             except ValueError:
                 p_val = 0.0
-            self.progress_callback(p_val)
+            self._emit(
+                'progress',
+                id=key,
+                percent=p_val,
+                downloaded_bytes=downloaded_bytes,
+                total_bytes=total_bytes,
+                speed=d.get('speed'),
+            )
 
     def _ffmpeg_available(self):
         """
@@ -1,8 +1,18 @@
 import os
+import queue
 import tkinter as tk
-from tkinter import messagebox, ttk
-from validators import is_valid_youtube_url
-from downloader import Downloader
+from tkinter import filedialog, messagebox, ttk
+from validators import canonical_youtube_url, extract_video_id, is_valid_youtube_url, split_urls
+from downloader import OUTPUT_MP3, OUTPUT_NATIVE, Downloader
+from queue_view import VirtualListbox
+from url_queue import UrlQueue
+
+# Интервал, с которым главный цикл Tk забирает события рабочих потоков, мс (~20 кадров/с)
+UI_REFRESH_MS = 50
+# Сколько последних строк хранит окно логов
+MAX_LOG_LINES = 2000
+# Сколько сообщений лога обрабатывается за один кадр, чтобы не подвешивать интерфейс
+MAX_LOG_BATCH = 500
 
 class YouTubeAudioDownloaderApp:
     def __init__(self, root):
@@ -38,8 +48,15 @@ class YouTubeAudioDownloaderApp:
             background="#4CAF50"
         )
 
-        # Очередь ссылок
-        self.audio_queue = []
+        # Очередь ссылок (в каноническом виде, с индексом для поиска дубликатов)
+        self.audio_queue = UrlQueue()
+
+        # События из рабочих потоков. Виджеты Tk нельзя трогать вне главного цикла,
+        # поэтому потоки только кладут события в очередь, а главный цикл
+        # забирает их раз в UI_REFRESH_MS. Прогресс не ставится в очередь:
+        # хранится только последнее значение, промежуточные просто перезаписываются.
+        self._events = queue.Queue()
+        self._pending_progress = None
         self.download_folder = os.path.join(os.getcwd(), "Downloaded_Audio")
 
         self._init_ui()
@@ -49,6 +66,31 @@ class YouTubeAudioDownloaderApp:
             log_callback=self.log,
             progress_callback=self.update_progress
         )
+        self._restore_queue()
+        self.downloader.prepare_archive()
+
+        self.root.after(UI_REFRESH_MS, self._process_events)
+
+    def _restore_queue(self):
+        """
+        Восстанавливает очередь, не завершённую в прошлый раз (сбой или закрытие окна).
+        """
+        journal = self.downloader.journal
+        urls = journal.pending_urls()
+        stale = []
+        for url in urls:
+            # Журнал мог быть записан до приведения ссылок к каноническому виду
+            if self.audio_queue.add(url) != url:
+                stale.append(url)
+        for url in stale:
+            journal.remove_url(url)
+        if stale:
+            canonical = {canonical_youtube_url(url) for url in stale}
+            journal.add_urls([url for url in self.audio_queue if url in canonical])
+        self.queue_listbox.refresh()
+        if self.audio_queue:
+            self.log(f"Восстановлена незавершённая очередь: {len(self.audio_queue)} ссылок. "
+                     f"Нажмите «Скачать аудио», чтобы продолжить.")
 
     def _init_ui(self):
         """
@@ -82,6 +124,8 @@ class YouTubeAudioDownloaderApp:
 
         ttk.Button(control_frame_1, text="Добавить в очередь", style="Custom.TButton",
                    command=self.add_to_queue).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame_1, text="Импорт из файла…", style="Custom.TButton",
+                   command=self.import_from_file).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame_1, text="Удалить выбранное", style="Custom.TButton",
                    command=self.remove_selected_from_queue).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame_1, text="Очистить очередь", style="Custom.TButton",
@@ -91,8 +135,27 @@ class YouTubeAudioDownloaderApp:
         control_frame_2 = ttk.Frame(self.root, padding="5 5 5 5")
         control_frame_2.pack(fill=tk.X)
 
-        ttk.Button(control_frame_2, text="Скачать аудио", style="Custom.TButton",
-                   command=self.start_download).pack(side=tk.LEFT, padx=5)
+        # Кнопка выключена, пока пакет выполняется (и дорабатывает после остановки)
+        self.download_button = ttk.Button(control_frame_2, text="Скачать аудио", style="Custom.TButton",
+                                          command=self.start_download)
+        self.download_button.pack(side=tk.LEFT, padx=5)
+
+        # Количество параллельных загрузок
+        ttk.Label(control_frame_2, text="Потоков:").pack(side=tk.LEFT, padx=(5, 0))
+        self.workers_var = tk.IntVar(value=1)
+        ttk.Spinbox(control_frame_2, from_=1, to=16, width=3,
+                    textvariable=self.workers_var).pack(side=tk.LEFT, padx=5)
+        # «Авто» — подбирать число загрузок по скорости, не больше указанного
+        self.adaptive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame_2, text="Авто",
+                        style="Custom.TCheckbutton",
+                        variable=self.adaptive_var).pack(side=tk.LEFT, padx=5)
+
+        # Общий лимит скорости в МБ/с (0 — без ограничения)
+        ttk.Label(control_frame_2, text="Лимит, МБ/с:").pack(side=tk.LEFT, padx=(5, 0))
+        self.rate_limit_var = tk.DoubleVar(value=0)
+        ttk.Spinbox(control_frame_2, from_=0, to=1000, increment=0.5, width=5,
+                    textvariable=self.rate_limit_var).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame_2, text="Остановить", style="Custom.TButton",
                    command=self.stop_download).pack(side=tk.LEFT, padx=5)
 
@@ -102,6 +165,12 @@ class YouTubeAudioDownloaderApp:
                         style="Custom.TCheckbutton",
                         variable=self.metadata_var).pack(side=tk.LEFT, padx=5)
 
+        # Чекбокс «Без перекодирования» — сохранять исходный кодек (Opus/AAC)
+        self.native_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame_2, text="Без перекодирования",
+                        style="Custom.TCheckbutton",
+                        variable=self.native_var).pack(side=tk.LEFT, padx=5)
+
         # --- Средняя часть: список очереди и логи ---
         middle_frame = ttk.Frame(self.root, padding="5 5 5 5")
         middle_frame.pack(fill="both", expand=True)
@@ -109,7 +178,8 @@ class YouTubeAudioDownloaderApp:
         queue_frame = ttk.Frame(middle_frame, relief=tk.GROOVE)
         queue_frame.pack(side=tk.LEFT, fill="both", expand=True, padx=5, pady=5)
         ttk.Label(queue_frame, text="Очередь ссылок:").pack()
-        self.queue_listbox = tk.Listbox(queue_frame, width=50, height=15, selectmode=tk.SINGLE)
+        # Отрисовываются только видимые строки, поэтому очередь может быть любой длины
+        self.queue_listbox = VirtualListbox(queue_frame, self.audio_queue, width=50, height=15)
         self.queue_listbox.pack(padx=5, pady=5, fill="both", expand=True)
 
         log_frame = ttk.Frame(middle_frame, relief=tk.GROOVE)
@@ -124,6 +194,10 @@ class YouTubeAudioDownloaderApp:
                                         style="Custom.Horizontal.TProgressbar")
         self.progress.pack(pady=5)
 
+        # Скорость, оставшееся время и число готовых треков
+        self.stats_label = ttk.Label(self.root, text="")
+        self.stats_label.pack(pady=(0, 5))
+
     # ------------------------------------------------------------------------
     #  Обработчик события <Control-KeyPress>
     #  Проверяем keycode: на Windows для физической клавиши V это 86,
@@ -149,9 +223,15 @@ class YouTubeAudioDownloaderApp:
         """
         try:
             clipboard_text = self.root.clipboard_get()
-            self.url_entry.insert(tk.INSERT, clipboard_text)
         except tk.TclError:
             messagebox.showwarning("Ошибка", "Буфер обмена пуст.")
+            return "break"
+        urls = split_urls(clipboard_text)
+        if len(urls) > 1:
+            # Список ссылок сразу добавляется в очередь, а не вставляется в поле ввода
+            self._import_urls(urls)
+        else:
+            self.url_entry.insert(tk.INSERT, clipboard_text)
         return "break"
 
     def select_all_text(self, event=None):
@@ -165,8 +245,50 @@ class YouTubeAudioDownloaderApp:
     # --- Остальные методы приложения ---
 
     def log(self, message):
+        """
+        Добавляет сообщение в лог. Можно вызывать из любого потока.
+        """
+        self._events.put(("log", message))
+
+    def _process_events(self):
+        """
+        Забирает накопившиеся события и обновляет виджеты одним пакетом за кадр.
+        """
+        # Планируем следующий кадр сразу: окно «Готово» ниже запускает вложенный
+        # цикл событий, и лог должен обновляться, пока оно открыто
+        self.root.after(UI_REFRESH_MS, self._process_events)
+
+        lines = []
+        finished = False
+        try:
+            while len(lines) < MAX_LOG_BATCH:
+                kind, payload = self._events.get_nowait()
+                if kind == "log":
+                    lines.append(payload)
+                elif kind == "done":
+                    finished = True
+                    break
+        except queue.Empty:
+            pass
+
+        if lines:
+            self._append_log(lines)
+
+        progress, self._pending_progress = self._pending_progress, None
+        if progress is not None:
+            self.progress.config(value=progress)
+            self._update_stats()
+
+        if finished:
+            self._downloads_finished()
+
+    def _append_log(self, lines):
         self.log_text.config(state="normal")
-        self.log_text.insert(tk.END, message + "\n")
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        # Окно логов работает как кольцевой буфер: старые строки удаляются
+        line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+        if line_count > MAX_LOG_LINES:
+            self.log_text.delete("1.0", f"{line_count - MAX_LOG_LINES + 1}.0")
         self.log_text.see(tk.END)
         self.log_text.config(state="disabled")
 
@@ -174,57 +296,172 @@ class YouTubeAudioDownloaderApp:
         self.url_entry.delete(0, tk.END)
 
     def add_to_queue(self):
-        url = self.url_entry.get().strip()
-        if not url:
+        urls = split_urls(self.url_entry.get())
+        if not urls:
             messagebox.showwarning("Ошибка", "Введите корректную ссылку!")
             return
+        if len(urls) > 1:
+            self._import_urls(urls)
+            self.url_entry.delete(0, tk.END)
+            return
+        url = urls[0]
 
         if not is_valid_youtube_url(url):
             messagebox.showwarning("Ошибка", "Ссылка не является ссылкой на YouTube!")
             return
 
-        self.audio_queue.append(url)
-        self.queue_listbox.insert(tk.END, url)
-        self.log(f"Добавлено в очередь: {url}")
+        # Пока индекс пересобирается, проверку пропускаем, чтобы не блокировать окно:
+        # скачанное видео всё равно будет пропущено при загрузке
+        archive = self.downloader.archive
+        record = archive.get(extract_video_id(url)) if archive.is_ready() else None
+        if record:
+            messagebox.showinfo("Уже скачано", f"Это видео уже скачано:\n{record['path']}")
+            return
+
+        canonical = self.audio_queue.add(url)
+        if canonical is None:
+            messagebox.showinfo("Уже в очереди", "Эта ссылка уже есть в очереди.")
+            return
+        self.downloader.journal.add_url(canonical)
+        self.queue_listbox.refresh()
+        self.log(f"Добавлено в очередь: {canonical}")
         self.url_entry.delete(0, tk.END)
 
+    def import_from_file(self):
+        """
+        Добавляет в очередь ссылки из текстового файла (по одной или несколько в строке).
+        """
+        path = filedialog.askopenfilename(
+            title="Файл со ссылками",
+            filetypes=[("Текстовые файлы", "*.txt"), ("Все файлы", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showwarning("Ошибка", f"Не удалось прочитать файл:\n{e}")
+            return
+        self._import_urls(split_urls(text))
+
+    def _import_urls(self, candidates):
+        """
+        Массовое добавление ссылок: дубликаты отсекаются по каноническому виду,
+        уже скачанные видео — одним запросом к архиву, в журнал пишется одна запись
+        на весь пакет, а в лог — одна итоговая строка вместо строки на ссылку.
+        """
+        added = []
+        duplicates = invalid = 0
+        for url in candidates:
+            if canonical_youtube_url(url) is None:
+                invalid += 1
+                continue
+            canonical = self.audio_queue.add(url)
+            if canonical is None:
+                duplicates += 1
+            else:
+                added.append(canonical)
+
+        ids = {extract_video_id(url): url for url in added}
+        ids.pop(None, None)
+        archive = self.downloader.archive
+        downloaded = archive.downloaded_ids(list(ids)) if archive.is_ready() else set()
+        for video_id in downloaded:
+            self.audio_queue.remove(ids[video_id])
+        if downloaded:
+            skipped = {ids[video_id] for video_id in downloaded}
+            added = [url for url in added if url not in skipped]
+
+        self.downloader.journal.add_urls(added)
+        self.queue_listbox.refresh()
+        self.log(f"Добавлено в очередь: {len(added)}, дубликатов: {duplicates}, "
+                 f"уже скачано: {len(downloaded)}, некорректных ссылок: {invalid}.")
+
     def remove_selected_from_queue(self):
-        selected_index = self.queue_listbox.curselection()
-        if selected_index:
-            index = selected_index[0]
-            url = self.audio_queue.pop(index)
-            self.queue_listbox.delete(index)
+        index = self.queue_listbox.curselection()
+        if index is not None:
+            url = self.audio_queue[index]
+            self.audio_queue.remove(url)
+            self.downloader.journal.remove_url(url)
+            self.queue_listbox.refresh()
             self.log(f"Удалено из очереди: {url}")
         else:
             messagebox.showwarning("Ошибка", "Выберите ссылку для удаления!")
 
     def clear_queue(self):
         self.audio_queue.clear()
-        self.queue_listbox.delete(0, tk.END)
+        self.downloader.journal.clear_urls()
+        self.queue_listbox.refresh()
         self.log("Очередь очищена.")
 
     def start_download(self):
+        if self.downloader.is_running():
+            # Настройки ниже нельзя менять на ходу: их читают рабочие потоки
+            messagebox.showwarning("Ошибка", "Предыдущая загрузка ещё не завершена!")
+            return
         if not self.audio_queue:
             messagebox.showwarning("Ошибка", "Очередь пуста!")
             return
 
         # Устанавливаем флаг метаданных
         self.downloader.with_metadata = self.metadata_var.get()
-        self.log("Начало загрузки...")
-        self.downloader.start_download(self.audio_queue.copy(), self.on_all_downloads_complete)
+        self.downloader.output_format = OUTPUT_NATIVE if self.native_var.get() else OUTPUT_MP3
+        try:
+            workers = self.workers_var.get()
+        except tk.TclError:
+            workers = 0
+        if workers < 1:
+            messagebox.showwarning("Ошибка", "Количество потоков должно быть целым числом не меньше 1!")
+            return
+        try:
+            rate_limit = self.rate_limit_var.get()
+        except tk.TclError:
+            rate_limit = -1
+        if rate_limit < 0:
+            messagebox.showwarning("Ошибка", "Лимит скорости должен быть числом не меньше 0!")
+            return
+        self.downloader.max_workers = workers
+        self.downloader.adaptive_concurrency = self.adaptive_var.get()
+        self.downloader.rate_limiter.rate = int(rate_limit * 1024 * 1024)
+        if self.downloader.start_download(self.audio_queue.urls(), self.on_all_downloads_complete):
+            self.download_button.state(["disabled"])
+            self.log("Начало загрузки...")
 
     def stop_download(self):
         self.downloader.stop_download()
 
     def on_all_downloads_complete(self):
-        self.root.after(0, self._downloads_finished)
+        self._events.put(("done", None))
+
+    def _update_stats(self):
+        snapshot = self.downloader.tracker.snapshot()
+        speed = snapshot['speed_bytes_per_sec']
+        eta = snapshot['eta_seconds']
+        parts = [f"Готово треков: {snapshot['completed']}/{snapshot['total']}"]
+        parts.append(f"скорость: {speed / 1024 / 1024:.2f} МБ/с")
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            parts.append(f"осталось: {minutes:02d}:{seconds:02d}")
+        self.stats_label.config(text=", ".join(parts))
 
     def _downloads_finished(self):
+        self.download_button.state(["!disabled"])
+        self._pending_progress = None
         self.progress["value"] = 0
+        self.stats_label.config(text="")
+        if self.downloader.stop_event.is_set():
+            # Очередь остаётся: повторный запуск продолжит с незавершённых этапов
+            self.log("Загрузка остановлена, очередь сохранена.")
+            return
         self.audio_queue.clear()
-        self.queue_listbox.delete(0, tk.END)
+        self.downloader.journal.clear_urls()
+        self.queue_listbox.refresh()
         self.log("Все задачи завершены.")
         messagebox.showinfo("Готово", "Все аудио успешно скачаны!")
 
     def update_progress(self, value):
-        self.root.after(0, lambda: self.progress.config(value=value))
+        """
+        Запоминает последнее значение прогресса. Можно вызывать из любого потока.
+        """
+        self._pending_progress = value
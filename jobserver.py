@@ -0,0 +1,365 @@
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from validators import canonical_youtube_url
+
+# Порт сервера задач по умолчанию
+DEFAULT_PORT = 8765
+# Время аренды задачи: если исполнитель не продлил её за это время, задача возвращается в очередь
+DEFAULT_LEASE_SECONDS = 60.0
+# Сколько раз задача выдаётся исполнителям, прежде чем считается окончательно неудачной
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Итог выполнения задачи, который сообщает исполнитель
+RESULT_DONE = 'done'
+RESULT_FAILED = 'failed'
+RESULT_RELEASED = 'released'  # Исполнитель остановлен и вернул задачу, попытка не считается
+
+
+class JobQueue:
+    def __init__(self, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 journal=None, event_callback=None):
+        """
+        Очередь задач координатора: одна задача — одна ссылка. Задачу-плейлист исполнитель
+        не скачивает сам, а раскрывает и ставит его записи в очередь отдельными задачами,
+        поэтому треки большого плейлиста расходятся по всем исполнителям.
+        Исполнители берут задачи в аренду, продлевают её сигналами и сообщают итог.
+        Просроченная аренда (исполнитель упал или потерял связь) возвращает задачу в очередь.
+        :param journal: Необязательный JobJournal: ссылки, ещё не выполненные до конца,
+                        переживают перезапуск координатора.
+        :param event_callback: Необязательный обработчик событий event_callback(event, fields).
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.journal = journal
+        self.event_callback = event_callback
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}  # ID -> задача (словарь)
+        self._pending = {}  # ID задач в очереди в порядке добавления (словарь: удаление за O(1))
+        self._leased = set()  # ID задач в аренде
+        self._urls = {}  # ссылка -> ID незавершённой задачи, для удаления дубликатов
+        self._counts = {RESULT_DONE: 0, RESULT_FAILED: 0}
+        self._has_jobs = False  # Была ли добавлена хотя бы одна задача
+        if journal is not None:
+            playlists = journal.pending_playlists()
+            self._add({url: playlists.get(url) for url in journal.pending_urls()})
+
+    def add(self, urls, playlists=None):
+        """
+        Ставит ссылки в очередь в каноническом виде (см. validators.canonical_youtube_url),
+        поэтому разные записи одного видео становятся одной задачей. Ссылки, которые
+        уже ждут или выполняются, пропускаются.
+        :param playlists: Необязательный словарь ссылка -> поля плейлиста для записей
+                          раскрытого плейлиста; они выдаются исполнителю вместе с задачей.
+        Возвращает (число добавленных задач, список отклонённых ссылок не на YouTube).
+        """
+        playlists = playlists or {}
+        canonical_urls = {}
+        rejected = []
+        for url in urls:
+            canonical = canonical_youtube_url(url)
+            if canonical is None:
+                rejected.append(url)
+            else:
+                canonical_urls[canonical] = playlists.get(url)
+        with self._lock:
+            added = self._add(canonical_urls)
+        if self.journal is not None:
+            self.journal.add_urls(added, {url: canonical_urls[url] for url in added if canonical_urls[url]})
+        for url in added:
+            self._emit('job_added', url=url)
+        for url in rejected:
+            self._emit('job_rejected', url=url, message="Ссылка не является ссылкой на YouTube")
+        return len(added), rejected
+
+    def lease(self, worker, count=1):
+        """
+        Выдаёт исполнителю worker до count задач из очереди.
+        """
+        now = time.monotonic()
+        leased = []
+        with self._lock:
+            expired = self._expire(now)
+            while self._pending and len(leased) < count:
+                job_id = next(iter(self._pending))
+                del self._pending[job_id]
+                self._leased.add(job_id)
+                job = self._jobs[job_id]
+                job.update(worker=worker, deadline=now + self.lease_seconds, attempts=job['attempts'] + 1)
+                leased.append({
+                    'id': job_id,
+                    'url': job['url'],
+                    'playlist': job['playlist'],
+                    'lease_seconds': self.lease_seconds,
+                })
+        self._publish(expired)
+        for job in leased:
+            self._emit('job_leased', id=job['id'], url=job['url'], worker=worker)
+        return leased
+
+    def heartbeat(self, worker, job_ids):
+        """
+        Продлевает аренду задач исполнителя. Возвращает ID задач, аренда которых
+        уже потеряна (истекла и задача отдана другому или завершена): их нужно прервать.
+        """
+        now = time.monotonic()
+        lost = []
+        with self._lock:
+            expired = self._expire(now)
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is None or job['worker'] != worker:
+                    lost.append(job_id)
+                else:
+                    job['deadline'] = now + self.lease_seconds
+        self._publish(expired)
+        return lost
+
+    def report(self, worker, job_id, result, details=None):
+        """
+        Принимает итог задачи. Неудачная задача возвращается в очередь, пока не исчерпаны
+        попытки. Возвращает False, если аренда уже потеряна и итог не принят.
+        """
+        with self._lock:
+            expired = self._expire(time.monotonic())
+            job = self._jobs.get(job_id)
+            accepted = job is not None and job['worker'] == worker
+            if accepted:
+                job['worker'] = None
+                self._leased.discard(job_id)
+                finished = False
+                if result == RESULT_RELEASED:
+                    job['attempts'] -= 1
+                    self._pending[job_id] = None
+                    event = 'job_released'
+                elif result != RESULT_DONE and job['attempts'] < self.max_attempts:
+                    self._pending[job_id] = None
+                    event = 'job_retry'
+                else:
+                    result = RESULT_DONE if result == RESULT_DONE else RESULT_FAILED
+                    self._finish(job_id)
+                    self._counts[result] += 1
+                    finished = True
+                    event = 'job_' + result
+        self._publish(expired)
+        if not accepted:
+            return False
+        if finished and self.journal is not None:
+            self.journal.remove_url(job['url'])
+        self._emit(event, id=job_id, url=job['url'], worker=worker, attempts=job['attempts'], details=details)
+        return True
+
+    def stats(self):
+        with self._lock:
+            expired = self._expire(time.monotonic())
+            stats = {
+                'pending': len(self._pending),
+                'leased': len(self._leased),
+                'done': self._counts[RESULT_DONE],
+                'failed': self._counts[RESULT_FAILED],
+            }
+        self._publish(expired)
+        return stats
+
+    def is_finished(self):
+        """
+        True, если все задачи выполнены: очередь пуста и ни одна задача не в аренде.
+        Пока не добавлено ни одной задачи, работа ещё не начата и не завершена.
+        """
+        with self._lock:
+            expired = self._expire(time.monotonic())
+            finished = self._has_jobs and not self._jobs
+        self._publish(expired)
+        return finished
+
+    def _add(self, urls):
+        """
+        :param urls: Словарь ссылка -> поля плейлиста или None.
+        """
+        added = []
+        for url, playlist in urls.items():
+            if url in self._urls:
+                continue
+            job_id = str(next(self._ids))
+            self._jobs[job_id] = {'url': url, 'playlist': playlist, 'worker': None, 'deadline': None, 'attempts': 0}
+            self._pending[job_id] = None
+            self._urls[url] = job_id
+            self._has_jobs = True
+            added.append(url)
+        return added
+
+    def _finish(self, job_id):
+        job = self._jobs.pop(job_id)
+        self._urls.pop(job['url'], None)
+
+    def _expire(self, now):
+        """
+        Возвращает в очередь задачи с просроченной арендой. Вызывается под self._lock
+        при каждом обращении, поэтому отдельный поток для проверки не нужен.
+        Возвращает события [(событие, поля)], которые вызывающий передаёт в _publish
+        после освобождения блокировки: обработчик событий и журнал пишут на диск.
+        """
+        events = []
+        for job_id in [job_id for job_id in self._leased if self._jobs[job_id]['deadline'] <= now]:
+            job = self._jobs[job_id]
+            worker, job['worker'] = job['worker'], None
+            self._leased.discard(job_id)
+            if job['attempts'] >= self.max_attempts:
+                self._finish(job_id)
+                self._counts[RESULT_FAILED] += 1
+                events.append(('job_failed', {'id': job_id, 'url': job['url'], 'worker': worker,
+                                              'attempts': job['attempts'], 'message': "Аренда истекла"}))
+            else:
+                self._pending[job_id] = None
+                events.append(('job_expired', {'id': job_id, 'url': job['url'], 'worker': worker}))
+        return events
+
+    def _publish(self, events):
+        """
+        Сообщает о событиях _expire. Вызывается без self._lock.
+        """
+        for event, fields in events:
+            if event == 'job_failed' and self.journal is not None:
+                self.journal.remove_url(fields['url'])
+            self._emit(event, **fields)
+
+    def _emit(self, event, **fields):
+        if self.event_callback is not None:
+            self.event_callback(event, fields)
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API координатора (тела запросов и ответов — JSON):
+      POST /jobs       {"urls": [...], "playlists": {ссылка: {...}}}
+                                                             -> {"added": N, "rejected": [ссылка, ...]}
+      POST /lease      {"worker": имя, "count": N}           -> {"jobs": [...], "finished": bool}
+      POST /heartbeat  {"worker": имя, "jobs": [ID, ...]}    -> {"lost": [ID, ...]}
+      POST /report     {"worker": имя, "id": ID, "result": done|failed|released, "details": {...}}
+                                                             -> {"accepted": bool}
+      GET  /status                                           -> счётчики задач
+    """
+    def do_GET(self):
+        if self.path == '/status':
+            self._send(200, self.server.jobs.stats())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        jobs = self.server.jobs
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/jobs':
+                playlists = {
+                    str(url): fields for url, fields in dict(body.get('playlists') or {}).items()
+                    if isinstance(fields, dict)
+                }
+                added, rejected = jobs.add([str(url) for url in body['urls']], playlists)
+                response = {'added': added, 'rejected': rejected}
+            elif self.path == '/lease':
+                leased = jobs.lease(str(body['worker']), int(body.get('count', 1)))
+                response = {'jobs': leased, 'finished': not leased and jobs.is_finished()}
+            elif self.path == '/heartbeat':
+                response = {'lost': jobs.heartbeat(str(body['worker']), list(body['jobs']))}
+            elif self.path == '/report':
+                accepted = jobs.report(str(body['worker']), str(body['id']), body['result'], body.get('details'))
+                response = {'accepted': accepted}
+            else:
+                self._send(404, {'error': 'not found'})
+                return
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': f"неверный запрос: {e}"})
+            return
+        self._send(200, response)
+
+    def _send(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class JobServer:
+    def __init__(self, jobs, host='127.0.0.1', port=DEFAULT_PORT):
+        """
+        HTTP-сервер координатора поверх JobQueue, работает в отдельном потоке.
+        По умолчанию слушает только локальный адрес; для исполнителей на других
+        машинах укажите host='0.0.0.0' (аутентификации нет — только в доверенной сети).
+        """
+        self.jobs = jobs
+        self._server = ThreadingHTTPServer((host, port), _JobRequestHandler)
+        self._server.daemon_threads = True
+        self._server.jobs = jobs
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class JobClient:
+    def __init__(self, server_url, timeout=30.0):
+        """
+        Клиент API координатора для исполнителей (только стандартная библиотека).
+        Ошибки сети выбрасываются как OSError (urllib.error.URLError — его подкласс).
+        """
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+
+    def add(self, urls, playlists=None):
+        """
+        Возвращает (число добавленных задач, список отклонённых ссылок).
+        """
+        response = self._request('/jobs', {'urls': list(urls), 'playlists': playlists or {}})
+        return response['added'], response['rejected']
+
+    def lease(self, worker, count=1):
+        """
+        Возвращает (список задач, завершены ли все задачи на сервере).
+        """
+        response = self._request('/lease', {'worker': worker, 'count': count})
+        return response['jobs'], response['finished']
+
+    def heartbeat(self, worker, job_ids):
+        return self._request('/heartbeat', {'worker': worker, 'jobs': list(job_ids)})['lost']
+
+    def report(self, worker, job_id, result, details=None):
+        return self._request('/report', {'worker': worker, 'id': job_id, 'result': result, 'details': details})['accepted']
+
+    def status(self):
+        return self._request('/status')
+
+    def _request(self, path, data=None):
+        body = None
+        headers = {}
+        if data is not None:
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json; charset=utf-8'
+        request = urllib.request.Request(self.server_url + path, data=body, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise OSError(f"сервер задач вернул {e.code}: {e.read().decode('utf-8', errors='replace')}") from e
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+
+# Имя файла журнала внутри папки загрузок
+JOURNAL_FILENAME = ".job_journal.jsonl"
+
+# Этапы обработки трека в порядке выполнения
+STAGE_QUEUED = 'queued'
+STAGE_DOWNLOADED = 'downloaded'
+STAGE_TRANSCODED = 'transcoded'
+STAGE_TAGGED = 'tagged'
+
+# Незавершённые задачи, которые не обновлялись дольше этого срока, при сжатии забываются
+JOB_MAX_AGE = 30 * 24 * 3600
+
+
+class JobJournal:
+    def __init__(self, path):
+        """
+        Журнал задач на диске, в который записи только добавляются (JSON Lines).
+        Хранит очередь ссылок и последний завершённый этап каждого трека,
+        чтобы после сбоя или закрытия программы продолжить с того же места.
+        Каждая запись сбрасывается на диск сразу; оборванная последняя строка
+        при чтении пропускается. При открытии журнал только читается, а сжимается
+        отдельным вызовом compact() (перезапись файла не должна задерживать запуск GUI).
+        :param path: Путь к файлу журнала.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Очередь ссылок в порядке добавления (словарь: удаление за O(1)); значение —
+        # поля плейлиста, если ссылка — запись плейлиста, раскрытого координатором
+        self._urls = {}
+        self._jobs = {}  # ключ трека -> поля последних записей и этап
+        self._records = 0  # Строк в файле: если их больше, чем записей состояния, есть что сжимать
+        torn = self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if torn:
+            # Следующая запись не должна дописаться к строке, оборванной при сбое
+            self._file.write("\n")
+
+    def pending_urls(self):
+        """
+        Ссылки, которые были в очереди на момент последней записи.
+        """
+        with self._lock:
+            return list(self._urls)
+
+    def add_url(self, url):
+        self.add_urls([url])
+
+    def pending_playlists(self):
+        """
+        Поля плейлиста ссылок в очереди, у которых они есть: словарь ссылка -> поля.
+        """
+        with self._lock:
+            return {url: playlist for url, playlist in self._urls.items() if playlist}
+
+    def add_urls(self, urls, playlists=None):
+        """
+        Добавляет несколько ссылок одной записью на диск (массовый импорт).
+        :param playlists: Необязательный словарь ссылка -> поля плейлиста.
+        """
+        if not urls:
+            return
+        playlists = playlists or {}
+        entries = [self._add_entry(url, playlists.get(url)) for url in urls]
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+            self._append_many(entries)
+
+    def remove_url(self, url):
+        with self._lock:
+            self._urls.pop(url, None)
+            self._append({'op': 'remove', 'url': url})
+
+    def clear_urls(self):
+        with self._lock:
+            self._urls.clear()
+            self._append({'op': 'clear'})
+
+    def record(self, key, stage, **fields):
+        """
+        Записывает, что трек key прошёл этап stage. Поля дополняют записанные ранее.
+        После STAGE_TAGGED трек считается готовым и из журнала удаляется.
+        """
+        if not key:
+            return
+        entry = {'op': 'stage', 'key': key, 'stage': stage, 'time': time.time(), **fields}
+        with self._lock:
+            self._apply(entry)
+            self._append(entry)
+
+    def get(self, key):
+        """
+        Возвращает словарь с этапом ('stage') и сохранёнными полями или None.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            return dict(job) if job is not None else None
+
+    def jobs(self):
+        """
+        Все незавершённые треки: словарь ключ -> копия записи (см. get).
+        """
+        with self._lock:
+            return {key: dict(job) for key, job in self._jobs.items()}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def compact(self):
+        """
+        Перезаписывает журнал минимальным набором записей с тем же состоянием
+        и забывает задачи старше JOB_MAX_AGE. Если сжимать нечего, файл не трогается.
+        """
+        with self._lock:
+            now = time.time()
+            self._jobs = {
+                key: job for key, job in self._jobs.items()
+                if now - job.get('time', now) <= JOB_MAX_AGE
+            }
+            if self._records <= len(self._urls) + len(self._jobs):
+                return
+            self._file.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for url, playlist in self._urls.items():
+                    f.write(json.dumps(self._add_entry(url, playlist), ensure_ascii=False) + "\n")
+                for key, job in self._jobs.items():
+                    f.write(json.dumps({'op': 'stage', 'key': key, **job}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._records = len(self._urls) + len(self._jobs)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _add_entry(url, playlist=None):
+        entry = {'op': 'add', 'url': url}
+        if playlist:
+            entry['playlist'] = playlist
+        return entry
+
+    def _append(self, entry):
+        self._append_many([entry])
+
+    def _append_many(self, entries):
+        self._records += len(entries)
+        self._file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._file.flush()
+        # fsync переживает не только падение программы, но и выключение компьютера
+        os.fsync(self._file.fileno())
+
+    def _apply(self, entry):
+        op = entry.get('op')
+        if op == 'add':
+            self._urls[entry['url']] = entry.get('playlist')
+        elif op == 'remove':
+            self._urls.pop(entry['url'], None)
+        elif op == 'clear':
+            self._urls.clear()
+        elif op == 'stage':
+            key = entry['key']
+            if entry['stage'] == STAGE_TAGGED:
+                self._jobs.pop(key, None)
+                return
+            job = self._jobs.setdefault(key, {})
+            job.update((name, value) for name, value in entry.items() if name not in ('op', 'key'))
+
+    def _load(self):
+        """
+        Читает журнал. Возвращает True, если последняя строка оборвана (нет перевода строки).
+        """
+        if not os.path.exists(self.path):
+            return False
+        line = "\n"
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._records += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Строка, оборванная при сбое, — все предыдущие записи уже применены
+                    continue
+                if isinstance(entry, dict):
+                    try:
+                        self._apply(entry)
+                    except (KeyError, TypeError):
+                        continue
+        return not line.endswith("\n")
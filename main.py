@@ -1,7 +1,15 @@
-import tkinter as tk
-from gui import YouTubeAudioDownloaderApp
+import sys
 
 def main():
+    # С аргументами работаем в режиме командной строки: tkinter не импортируется,
+    # поэтому программа запускается и на сервере без графической среды.
+    if len(sys.argv) > 1:
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    import tkinter as tk
+    from gui import YouTubeAudioDownloaderApp
+
     root = tk.Tk()
     app = YouTubeAudioDownloaderApp(root)
     root.mainloop()
@@ -1,56 +1,291 @@
+import base64
+import io
 import os
-from PIL import Image
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, error
-from mutagen.mp3 import MP3
+import re
 
-def convert_thumbnail(webp_path):
+# Pillow и mutagen импортируются внутри функций: модуль загружается при старте
+# приложения, а сами библиотеки нужны только на этапе записи тегов.
+
+# Имя пользовательского тега с ID видео: ID3 (TXXX), Vorbis comment и MP4 (freeform)
+VIDEO_ID_TAG = 'YouTube ID'
+VORBIS_VIDEO_ID_TAG = 'youtube_id'
+MP4_VIDEO_ID_TAG = '----:com.apple.iTunes:YouTube ID'
+
+# Форматы с тегами Vorbis comments
+VORBIS_FORMATS = ('.opus', '.ogg', '.flac')
+
+METADATA_ADDED = "Metadata added successfully."
+
+# Символы, которые экранируются в значениях формата ffmetadata
+_FFMETADATA_SPECIAL_RE = re.compile(r'([=;#\\\n])')
+
+# Тег-заполнитель, которым проход ffmpeg резервирует в M4A место под ID видео:
+# произвольный атом '----' ffmpeg не пишет, его потом записывает mutagen на место
+# заполнителя, не сдвигая остальной файл (см. write_mp4_video_id).
+# Ключ ffmpeg 'synopsis' — атом 'ldes', который проигрыватели не показывают
+_MP4_ID_PLACEHOLDER_KEY = 'synopsis'
+_MP4_ID_PLACEHOLDER_ATOM = 'ldes'
+_MP4_ID_PLACEHOLDER = ' ' * 96
+
+def _vorbis_class(ext):
     """
-    Конвертирует webp изображение в jpeg формат и возвращает путь к новому файлу.
-    Если не удаётся открыть изображение, возвращает None.
+    Возвращает класс mutagen для формата с Vorbis comments.
+    Импорты явные, чтобы PyInstaller включил модули в сборку.
     """
-    if not os.path.exists(webp_path):
+    if ext == '.opus':
+        from mutagen.oggopus import OggOpus
+        return OggOpus
+    if ext == '.ogg':
+        from mutagen.oggvorbis import OggVorbis
+        return OggVorbis
+    from mutagen.flac import FLAC
+    return FLAC
+
+# Максимальная сторона обложки по умолчанию, пикселей
+DEFAULT_COVER_SIZE = 600
+
+def convert_thumbnail(image_data, max_size=DEFAULT_COVER_SIZE):
+    """
+    Готовит обложку в памяти: декодирует изображение (webp, jpeg, png...),
+    при необходимости уменьшает до max_size по большей стороне и кодирует в JPEG.
+    Если исходник уже JPEG подходящего размера, байты возвращаются без перекодирования.
+    Возвращает байты JPEG или None, если изображение не удалось открыть.
+    """
+    if not image_data:
         return None
+    from PIL import Image
     try:
-        img = Image.open(webp_path).convert("RGB")
-        jpeg_path = webp_path.replace(".webp", ".jpg")
-        img.save(jpeg_path, "JPEG")
-        return jpeg_path
+        img = Image.open(io.BytesIO(image_data))
+        fits = not max_size or max(img.size) <= max_size
+        if img.format == "JPEG" and img.mode == "RGB" and fits:
+            return image_data
+        if not fits:
+            # Для JPEG draft декодирует сразу в уменьшенном масштабе
+            img.draft("RGB", (max_size, max_size))
+            img = img.convert("RGB")
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+        else:
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=90)
+        return buffer.getvalue()
     except Exception:
         return None
 
-def add_metadata(file_path, info, thumbnail_path):
+def add_metadata(file_path, info, cover_data=None):
     """
-    Добавляет метаданные и обложку в MP3-файл.
+    Добавляет метаданные и обложку в аудиофайл.
+    Поддерживаются MP3 (ID3), Opus/Ogg Vorbis/FLAC (Vorbis comments) и M4A (MP4-теги),
+    формат определяется по расширению файла.
     info - словарь, возвращаемый yt_dlp с информацией о треке.
+    cover_data - байты обложки в формате JPEG (см. convert_thumbnail) или None.
     """
     if not os.path.exists(file_path):
-        return "MP3 file not found."
+        return "Audio file not found."
+
+    title, artist, album, video_id = _basic_tags(info)
+
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.mp3':
+        _tag_mp3(file_path, title, artist, album, video_id, cover_data)
+    elif ext in VORBIS_FORMATS:
+        _tag_vorbis(file_path, _vorbis_class(ext), title, artist, album, video_id, cover_data)
+    elif ext in ('.m4a', '.mp4'):
+        _tag_mp4(file_path, title, artist, album, video_id, cover_data)
+    else:
+        return f"Unsupported audio format: {ext}"
+    return METADATA_ADDED
+
+def _basic_tags(info):
+    """
+    Базовые метаданные трека: (название, исполнитель, альбом, ID видео).
+    """
+    return (
+        info.get('title', 'Unknown Title'),
+        info.get('uploader', 'Unknown Artist'),
+        info.get('playlist_title', 'YouTube Audio'),
+        info.get('id'),
+    )
+
+def ffmpeg_tag_args(ext, info, cover_data=None):
+    """
+    Аргументы ffmpeg, с которыми теги и обложка записываются при перекодировании,
+    в том же проходе, что и звук. Так файл пишется на диск один раз: mutagen после
+    ffmpeg обычно переписывает файл целиком, чтобы расширить заголовок с тегами.
+    Обложка (и для Ogg весь набор тегов) передаётся через stdin ffmpeg, а не в
+    командной строке: обложка в base64 не помещается в лимит длины команды Windows.
+    Для M4A ID видео ffmpeg записать не может — он резервирует под него место,
+    а сам ID затем записывает write_mp4_video_id.
+    Аудиодорожка должна быть входом 0 команды.
+    :param ext: Расширение выходного файла.
+    :param info: Словарь yt_dlp с информацией о треке.
+    :param cover_data: Байты обложки в формате JPEG или None.
+    :return: (аргументы входов, аргументы выхода, данные для stdin или None)
+             или None, если формат не входит в FFMPEG_TAG_FORMATS.
+    """
+    title, artist, album, video_id = _basic_tags(info)
+    ext = ext.lower()
+    if ext in ('.mp3', '.m4a'):
+        tags = {'title': title, 'artist': artist, 'album': album}
+        output_args = ['-map', '0:a:0', '-map_metadata', '-1']
+        if ext == '.mp3':
+            output_args += ['-id3v2_version', '3']
+            if video_id:
+                # Ключ, которого нет среди стандартных, ffmpeg записывает в кадр TXXX
+                tags[VIDEO_ID_TAG] = video_id
+        elif video_id:
+            tags[_MP4_ID_PLACEHOLDER_KEY] = _MP4_ID_PLACEHOLDER
+        for name, value in tags.items():
+            output_args += ['-metadata', f'{name}={value}']
+        if not cover_data:
+            return [], output_args, None
+        # Обложка — второй вход, картинка кладётся в кадр APIC (в M4A — атом covr)
+        # без перекодирования
+        input_args = ['-f', 'jpeg_pipe', '-i', 'pipe:0']
+        output_args += [
+            '-map', '1:v', '-codec:v', 'copy', '-disposition:v', 'attached_pic',
+            '-metadata:s:v', 'title=Cover', '-metadata:s:v', 'comment=Cover (front)',
+        ]
+        return input_args, output_args, cover_data
+
+    if ext in ('.opus', '.ogg'):
+        tags = {'title': title, 'artist': artist, 'album': album}
+        if video_id:
+            tags[VORBIS_VIDEO_ID_TAG] = video_id
+        if cover_data:
+            tags['metadata_block_picture'] = _picture_comment(_cover_picture(cover_data))
+        lines = [';FFMETADATA1']
+        lines += [name + '=' + _FFMETADATA_SPECIAL_RE.sub(r'\\\1', str(value)) for name, value in tags.items()]
+        input_args = ['-f', 'ffmetadata', '-i', 'pipe:0']
+        output_args = ['-map', '0:a:0', '-map_metadata', '1']
+        return input_args, output_args, ('\n'.join(lines) + '\n').encode('utf-8')
+
+    return None
+
+def _tag_mp3(file_path, title, artist, album, video_id, cover_data):
+    from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TXXX, error
+    from mutagen.mp3 import MP3
 
     # Получаем теги или создаём, если их нет
     try:
         audio = MP3(file_path, ID3=ID3)
     except error:
         audio = MP3(file_path)
+    if audio.tags is None:
         audio.add_tags()
 
     # Добавление обложки, если есть
-    if thumbnail_path and os.path.exists(thumbnail_path):
-        with open(thumbnail_path, 'rb') as img:
-            audio.tags.add(APIC(
-                encoding=3,  # UTF-8
-                mime='image/jpeg',
-                type=3,  # Front cover
-                desc='Cover',
-                data=img.read()
-            ))
-    # Добавляем базовые метаданные
-    title = info.get('title', 'Unknown Title')
-    artist = info.get('uploader', 'Unknown Artist')
-    album = info.get('playlist_title', 'YouTube Audio')
+    if cover_data:
+        audio.tags.add(APIC(
+            encoding=3,  # UTF-8
+            mime='image/jpeg',
+            type=3,  # Front cover
+            desc='Cover',
+            data=cover_data
+        ))
 
     audio.tags.add(TIT2(encoding=3, text=title))
     audio.tags.add(TPE1(encoding=3, text=artist))
     audio.tags.add(TALB(encoding=3, text=album))
 
+    # ID видео нужен, чтобы индекс скачанного можно было восстановить по файлам
+    if video_id:
+        audio.tags.add(TXXX(encoding=3, desc=VIDEO_ID_TAG, text=video_id))
+
     audio.save(v2_version=3)
-    return "Metadata added successfully."
+
+def _tag_vorbis(file_path, audio_class, title, artist, album, video_id, cover_data):
+    from mutagen.flac import FLAC
+
+    audio = audio_class(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    audio['title'] = title
+    audio['artist'] = artist
+    audio['album'] = album
+    if video_id:
+        audio[VORBIS_VIDEO_ID_TAG] = video_id
+
+    if cover_data:
+        picture = _cover_picture(cover_data)
+        if isinstance(audio, FLAC):
+            audio.clear_pictures()
+            audio.add_picture(picture)
+        else:
+            audio['metadata_block_picture'] = _picture_comment(picture)
+
+    audio.save()
+
+def _cover_picture(cover_data):
+    from mutagen.flac import Picture
+
+    picture = Picture()
+    picture.type = 3  # Front cover
+    picture.mime = 'image/jpeg'
+    picture.desc = 'Cover'
+    picture.data = cover_data
+    return picture
+
+def _picture_comment(picture):
+    # В Ogg обложка хранится как комментарий с блоком FLAC-картинки в base64
+    return base64.b64encode(picture.write()).decode('ascii')
+
+def _tag_mp4(file_path, title, artist, album, video_id, cover_data):
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+
+    audio = MP4(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+
+    audio.tags['\xa9nam'] = [title]
+    audio.tags['\xa9ART'] = [artist]
+    audio.tags['\xa9alb'] = [album]
+    if video_id:
+        audio.tags[MP4_VIDEO_ID_TAG] = [MP4FreeForm(video_id.encode('utf-8'))]
+    if cover_data:
+        audio.tags['covr'] = [MP4Cover(cover_data, imageformat=MP4Cover.FORMAT_JPEG)]
+
+    audio.save()
+
+def write_mp4_video_id(file_path, video_id):
+    """
+    Записывает ID видео в M4A после прохода ffmpeg (см. ffmpeg_tag_args) на место
+    тега-заполнителя: размер списка тегов почти не меняется, и mutagen переписывает
+    только его, без перезаписи звука.
+    """
+    from mutagen.mp4 import MP4, MP4FreeForm
+
+    audio = MP4(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+    placeholder = audio.tags.get(_MP4_ID_PLACEHOLDER_ATOM)
+    if placeholder and not any(value.strip() for value in placeholder):
+        del audio.tags[_MP4_ID_PLACEHOLDER_ATOM]
+    audio.tags[MP4_VIDEO_ID_TAG] = [MP4FreeForm(video_id.encode('utf-8'))]
+    audio.save()
+
+def read_video_id(file_path):
+    """
+    Возвращает ID видео, сохранённый в тегах аудиофайла, или None.
+    """
+    from mutagen import MutagenError
+
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == '.mp3':
+            from mutagen.id3 import ID3
+            frames = ID3(file_path).getall(f'TXXX:{VIDEO_ID_TAG}')
+            values = frames[0].text if frames else []
+        elif ext in VORBIS_FORMATS:
+            tags = _vorbis_class(ext)(file_path).tags
+            values = tags.get(VORBIS_VIDEO_ID_TAG, []) if tags is not None else []
+        elif ext in ('.m4a', '.mp4'):
+            from mutagen.mp4 import MP4
+            tags = MP4(file_path).tags
+            values = [bytes(v).decode('utf-8') for v in tags.get(MP4_VIDEO_ID_TAG, [])] if tags is not None else []
+        else:
+            return None
+    except (MutagenError, OSError):
+        return None
+    return str(values[0]) if values else None
@@ -0,0 +1,124 @@
+import queue
+import threading
+
+# Маркер завершения работы для потоков этапа
+_STOP = object()
+
+_local = threading.local()
+
+
+def worker_index():
+    """
+    Возвращает номер рабочего потока внутри текущего этапа (начиная с 1)
+    или None, если вызов сделан не из потока конвейера.
+    """
+    return getattr(_local, 'index', None)
+
+
+class Stage:
+    def __init__(self, name, handler, workers=1, queue_size=None):
+        """
+        Этап конвейера со своим пулом потоков и ограниченной входной очередью.
+        :param name: Имя этапа (используется в именах потоков и сообщениях).
+        :param handler: Функция обработки элемента. Возвращает список (или генератор)
+                        элементов для следующего этапа (для последнего этапа результат игнорируется).
+        :param workers: Количество потоков этапа.
+        :param queue_size: Размер входной очереди. По умолчанию — удвоенное число потоков.
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        if queue_size is None:
+            queue_size = self.workers * 2
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = None
+        self._threads = []
+
+    def start(self, stop_event, error_callback, drop_callback):
+        """
+        Запускает потоки этапа.
+        """
+        self._threads = [
+            threading.Thread(
+                target=self._run,
+                args=(index, stop_event, error_callback, drop_callback),
+                name=f"{self.name}-{index}",
+                daemon=True,
+            )
+            for index in range(1, self.workers + 1)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        """
+        Кладёт элемент во входную очередь. Блокируется, если очередь заполнена,
+        за счёт этого медленный этап притормаживает предыдущие.
+        """
+        self.queue.put(item)
+
+    def close(self):
+        """
+        Сообщает потокам, что новых элементов не будет, и ждёт их завершения.
+        """
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, index, stop_event, error_callback, drop_callback):
+        _local.index = index
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            # После остановки продолжаем разбирать очередь, чтобы не блокировать
+            # предыдущие этапы, но элементы уже не обрабатываем.
+            if stop_event.is_set():
+                drop_callback(item)
+                continue
+            try:
+                results = self.handler(item)
+                # Обработчик может вернуть генератор: тогда элементы уходят
+                # на следующий этап по мере получения, а не после обработки целиком.
+                if self.next_stage is not None and results:
+                    for result in results:
+                        self.next_stage.put(result)
+            except Exception as e:
+                error_callback(self, item, e)
+
+
+class Pipeline:
+    def __init__(self, stages, stop_event, error_callback, drop_callback):
+        """
+        Конвейер из последовательных этапов. Этапы работают одновременно:
+        следующий этап одного элемента перекрывается с предыдущим этапом другого.
+        :param stages: Список объектов Stage в порядке обработки.
+        :param stop_event: threading.Event для отмены обработки.
+        :param error_callback: Вызывается как error_callback(stage, item, exception).
+        :param drop_callback: Вызывается для элементов, отброшенных после остановки.
+        """
+        self.stages = stages
+        self.stop_event = stop_event
+        self.error_callback = error_callback
+        self.drop_callback = drop_callback
+        for current, following in zip(stages, stages[1:]):
+            current.next_stage = following
+
+    def run(self, items):
+        """
+        Пропускает элементы через все этапы и возвращается, когда конвейер опустеет.
+        """
+        for stage in self.stages:
+            stage.start(self.stop_event, self.error_callback, self.drop_callback)
+
+        for item in items:
+            if self.stop_event.is_set():
+                self.drop_callback(item)
+                continue
+            self.stages[0].put(item)
+
+        # Закрываем этапы по порядку: каждый следующий получает маркер
+        # завершения только после того, как предыдущий отдал ему все элементы.
+        for stage in self.stages:
+            stage.close()
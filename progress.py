@@ -0,0 +1,292 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Окно, по которому считается текущая скорость скачивания, секунд
+SPEED_WINDOW = 5.0
+
+METRICS_JSON = 'json'
+METRICS_PROMETHEUS = 'prometheus'
+
+
+class ProgressTracker:
+    def __init__(self):
+        """
+        Общий прогресс пакета загрузок, взвешенный по размеру файлов.
+        Для треков, размер которых ещё неизвестен, используется средний размер
+        уже известных. Дополнительно считает скорость, оставшееся время и
+        время, проведённое в каждом этапе конвейера.
+        Суммы для прогресса обновляются при каждом событии, поэтому percent()
+        не зависит от числа треков: его вызывает хук каждого скачиваемого блока.
+        """
+        self._lock = threading.Lock()
+        self.reset(0)
+
+    def reset(self, total):
+        """
+        Начинает новый пакет из total треков (до раскрытия плейлистов — по числу ссылок).
+        """
+        with self._lock:
+            self._started = time.monotonic()
+            self._total = total
+            self._completed = 0
+            self._failed = 0
+            self._sizes = {}  # ключ трека -> размер в байтах
+            self._downloaded = {}  # ключ трека -> скачано байт
+            self._done_keys = set()
+            # Суммы по _sizes: треки известного размера (их размеры и прогресс с учётом
+            # этого размера) и треки неизвестного размера (число, завершённые, скачано байт)
+            self._known_size = 0
+            self._known_count = 0
+            self._known_done = 0
+            self._unknown_count = 0
+            self._unknown_finished = 0
+            self._unknown_downloaded = 0
+            self._bytes_total = 0  # Всего скачано байт за пакет
+            self._samples = deque()  # (время, скачано байт) для расчёта скорости
+            self._stages = {}  # этап -> [количество, сумма секунд, максимум секунд]
+
+    def add_tracks(self, count):
+        """
+        Увеличивает число треков, например после раскрытия плейлиста.
+        """
+        with self._lock:
+            self._total += count
+
+    def update_bytes(self, key, downloaded, total):
+        """
+        Обновляет число скачанных байт трека (вызывается из хука прогресса yt_dlp).
+        Возвращает число байт, добавившихся с прошлого вызова.
+        """
+        now = time.monotonic()
+        counted = 0
+        with self._lock:
+            self._account(key, -1)
+            if total:
+                self._sizes[key] = total
+            elif key not in self._sizes:
+                self._sizes[key] = None
+            previous = self._downloaded.get(key)
+            if downloaded is not None:
+                # Первое событие трека может включать байты, скачанные до перезапуска
+                # (загрузка продолжена с файла .part), — они не входят в скорость.
+                # Потеря первого блока новой загрузки (около килобайта) несущественна.
+                if previous is None:
+                    previous = downloaded
+                # При повторной попытке счётчик начинается заново — такие байты не считаем
+                counted = max(0, downloaded - previous)
+                self._bytes_total += counted
+                self._downloaded[key] = downloaded
+            self._account(key, 1)
+            self._samples.append((now, self._bytes_total))
+            while self._samples and now - self._samples[0][0] > SPEED_WINDOW:
+                self._samples.popleft()
+        return counted
+
+    def track_finished(self, key=None):
+        """
+        Отмечает трек завершённым (успешно или с ошибкой).
+        """
+        with self._lock:
+            self._completed += 1
+            if key in self._sizes and key not in self._done_keys:
+                self._account(key, -1)
+                self._done_keys.add(key)
+                self._account(key, 1)
+
+    def _account(self, key, sign):
+        """
+        Добавляет (sign=1) или вычитает (sign=-1) вклад трека key в суммы прогресса.
+        Вызывается под self._lock: вклад вычитается до изменения трека и добавляется после.
+        """
+        if key not in self._sizes:
+            return
+        size = self._sizes[key]
+        done = key in self._done_keys
+        downloaded = self._downloaded.get(key) or 0
+        if size:
+            self._known_size += sign * size
+            self._known_count += sign
+            self._known_done += sign * (size if done else min(downloaded, size))
+        else:
+            self._unknown_count += sign
+            if done:
+                self._unknown_finished += sign
+            else:
+                self._unknown_downloaded += sign * downloaded
+
+    def _weights(self):
+        """
+        Возвращает (общий вес пакета, вес выполненного, известен ли размер хотя бы одного трека).
+        Вызывается под self._lock.
+        """
+        known = self._known_count > 0
+        average = self._known_size / self._known_count if known else 1.0
+        # Треки без сведений о размере (ещё не начатые или завершённые без скачивания)
+        untracked_total = max(0, self._total - len(self._sizes))
+        untracked_done = max(0, self._completed - len(self._done_keys))
+        weight_total = self._known_size + (self._unknown_count + untracked_total) * average
+        unknown_active = self._unknown_count - self._unknown_finished
+        weight_done = (
+            self._known_done
+            + self._unknown_finished * average
+            + min(self._unknown_downloaded, unknown_active * average)
+            + min(untracked_done, untracked_total) * average
+        )
+        return weight_total, weight_done, known
+
+    def record_failure(self):
+        with self._lock:
+            self._failed += 1
+
+    def record_stage(self, stage, seconds):
+        """
+        Учитывает время, проведённое одним треком в этапе конвейера.
+        """
+        with self._lock:
+            stats = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def percent(self):
+        with self._lock:
+            weight_total, weight_done, _ = self._weights()
+        return min(100.0, weight_done / weight_total * 100) if weight_total else 0.0
+
+    def snapshot(self):
+        """
+        Возвращает словарь с текущим состоянием: прогресс, байты, скорость, ETA и этапы.
+        """
+        now = time.monotonic()
+        with self._lock:
+            weight_total, weight_done, known = self._weights()
+            percent = min(100.0, weight_done / weight_total * 100) if weight_total else 0.0
+
+            speed = 0.0
+            # Пока нет свежих данных (например, все потоки перекодируют), скорость равна нулю
+            if len(self._samples) >= 2 and now - self._samples[-1][0] <= SPEED_WINDOW:
+                (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+                if t1 > t0:
+                    speed = (b1 - b0) / (t1 - t0)
+            remaining = max(0.0, weight_total - weight_done) if known else None
+            eta = remaining / speed if speed > 0 and remaining is not None else None
+
+            return {
+                'total': self._total,
+                'completed': self._completed,
+                'failed': self._failed,
+                'percent': percent,
+                'downloaded_bytes': self._bytes_total,
+                'estimated_total_bytes': int(weight_total) if known else None,
+                'speed_bytes_per_sec': speed,
+                'eta_seconds': eta,
+                'elapsed_seconds': now - self._started,
+                'stages': {
+                    stage: {'count': count, 'total_seconds': total, 'max_seconds': longest}
+                    for stage, (count, total, longest) in self._stages.items()
+                },
+            }
+
+
+def format_prometheus(snapshot, prefix='ytad'):
+    """
+    Форматирует снимок ProgressTracker в текстовом формате Prometheus.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, value, labels=None):
+        if value is None:
+            return
+        full_name = f"{prefix}_{name}"
+        if not labels or not any(line.startswith(f"# HELP {full_name} ") for line in lines):
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+        label_text = ""
+        if labels:
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+        lines.append(f"{full_name}{label_text} {value}")
+
+    metric('tracks_total', 'gauge', 'Tracks in the current batch.', snapshot['total'])
+    metric('tracks_completed', 'gauge', 'Tracks finished, successfully or not.', snapshot['completed'])
+    metric('tracks_failed', 'gauge', 'Tracks that failed.', snapshot['failed'])
+    metric('progress_percent', 'gauge', 'Byte-weighted batch progress.', round(snapshot['percent'], 2))
+    metric('downloaded_bytes_total', 'counter', 'Bytes downloaded in the current batch.',
+           snapshot['downloaded_bytes'])
+    metric('estimated_total_bytes', 'gauge', 'Estimated size of the whole batch.',
+           snapshot['estimated_total_bytes'])
+    metric('download_speed_bytes', 'gauge', 'Current download speed, bytes per second.',
+           round(snapshot['speed_bytes_per_sec'], 1))
+    metric('eta_seconds', 'gauge', 'Estimated time to finish the batch.',
+           round(snapshot['eta_seconds'], 1) if snapshot['eta_seconds'] is not None else None)
+    metric('elapsed_seconds', 'gauge', 'Time since the batch started.', round(snapshot['elapsed_seconds'], 1))
+    # Все значения одной метрики в формате Prometheus должны идти подряд
+    stages = snapshot['stages']
+    for stage, stats in stages.items():
+        metric('stage_seconds_sum', 'counter', 'Total time spent in a pipeline stage.',
+               round(stats['total_seconds'], 3), {'stage': stage})
+    for stage, stats in stages.items():
+        metric('stage_seconds_count', 'counter', 'Tracks that passed a pipeline stage.',
+               stats['count'], {'stage': stage})
+    for stage, stats in stages.items():
+        metric('stage_seconds_max', 'gauge', 'Longest time one track spent in a stage.',
+               round(stats['max_seconds'], 3), {'stage': stage})
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    def __init__(self, tracker, path, fmt=METRICS_JSON, interval=5.0, log_callback=None):
+        """
+        Периодически записывает снимок ProgressTracker в файл (JSON или Prometheus).
+        Файл заменяется атомарно, поэтому читатель никогда не видит его наполовину записанным.
+        :param log_callback: Необязательная функция для сообщения об ошибке записи итогового снимка.
+        """
+        self.tracker = tracker
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.log_callback = log_callback
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливает запись и сохраняет итоговый снимок. Ошибка записи
+        только сообщается: завершение загрузки от файла метрик не зависит.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.write()
+        except OSError as e:
+            if self.log_callback is not None:
+                self.log_callback(f"Не удалось записать метрики в {self.path}: {e}")
+
+    def write(self):
+        snapshot = self.tracker.snapshot()
+        if self.fmt == METRICS_PROMETHEUS:
+            content = format_prometheus(snapshot)
+        else:
+            content = json.dumps(snapshot, ensure_ascii=False, indent=2)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                # Ошибка записи метрик не должна прерывать загрузку
+                pass
@@ -0,0 +1,84 @@
+import tkinter as tk
+from tkinter import font as tkfont
+from tkinter import ttk
+
+
+class VirtualListbox(ttk.Frame):
+    def __init__(self, master, items, **listbox_options):
+        """
+        Список, который создаёт строки только для видимой части данных.
+        tk.Listbox хранит каждую строку как элемент Tk, поэтому на десятках тысяч
+        записей вставка и прокрутка заметно тормозят; здесь Listbox всегда содержит
+        столько строк, сколько помещается в окне, а при прокрутке они перезаполняются.
+        :param items: Последовательность строк (поддерживает len() и срезы).
+        :param listbox_options: Параметры для tk.Listbox (width, height и т.д.).
+        """
+        super().__init__(master)
+        self.items = items
+        self._first = 0  # Номер записи в первой видимой строке
+        self._selected = None  # Номер выбранной записи в items
+
+        self.listbox = tk.Listbox(self, selectmode=tk.SINGLE, exportselection=False, **listbox_options)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill="both", expand=True)
+
+        self._line_height = tkfont.Font(font=self.listbox.cget("font")).metrics("linespace") + 1
+        self.listbox.bind("<Configure>", lambda event: self.refresh())
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        # Колесо мыши: Windows и macOS присылают <MouseWheel>, X11 — кнопки 4 и 5
+        self.listbox.bind("<MouseWheel>", lambda event: self._scroll(-1 if event.delta > 0 else 1, "units"))
+        self.listbox.bind("<Button-4>", lambda event: self._scroll(-1, "units"))
+        self.listbox.bind("<Button-5>", lambda event: self._scroll(1, "units"))
+
+    def visible_rows(self):
+        height = self.listbox.winfo_height()
+        if height <= 1:
+            # Окно ещё не отрисовано — берём высоту из параметров
+            return int(self.listbox.cget("height"))
+        return max(1, height // self._line_height)
+
+    def refresh(self):
+        """
+        Перерисовывает видимые строки. Вызывается после изменения items.
+        """
+        total = len(self.items)
+        rows = self.visible_rows()
+        self._first = max(0, min(self._first, total - rows))
+        if self._selected is not None and self._selected >= total:
+            self._selected = None
+
+        self.listbox.delete(0, tk.END)
+        visible = self.items[self._first:self._first + rows]
+        if visible:
+            self.listbox.insert(tk.END, *visible)
+        if self._selected is not None and self._first <= self._selected < self._first + rows:
+            self.listbox.selection_set(self._selected - self._first)
+
+        if total:
+            self.scrollbar.set(self._first / total, min(1.0, (self._first + rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def curselection(self):
+        """
+        Номер выбранной записи в items или None.
+        """
+        return self._selected
+
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        self._selected = self._first + selection[0] if selection else None
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self._first = int(float(value) * len(self.items))
+            self.refresh()
+        else:
+            self._scroll(int(value), unit)
+
+    def _scroll(self, amount, unit):
+        step = self.visible_rows() if unit == "pages" else 1
+        self._first += amount * step
+        self.refresh()
+        return "break"
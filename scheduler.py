@@ -0,0 +1,291 @@
+import random
+import re
+import socket
+import threading
+import time
+
+# Коды HTTP, при которых запрос имеет смысл повторить позже
+_TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# 429 — сервер прямо просит снизить нагрузку
+_THROTTLE_STATUSES = {429}
+_HTTP_STATUS_RE = re.compile(r'HTTP Error (\d{3})')
+# Фрагменты сообщений сетевых ошибок, которые yt_dlp передаёт только текстом
+_TRANSIENT_MESSAGES = (
+    'timed out',
+    'connection reset',
+    'connection aborted',
+    'connection refused',
+    'remote end closed',
+    'temporary failure in name resolution',
+    'network is unreachable',
+    'incompleteread',
+    'incomplete read',
+    'eof occurred in violation of protocol',
+)
+
+ERROR_PERMANENT = 'permanent'
+ERROR_TRANSIENT = 'transient'
+ERROR_THROTTLED = 'throttled'
+
+
+class DownloadCancelled(Exception):
+    """
+    Загрузка остановлена пользователем до или во время ожидания повтора.
+    """
+
+
+def classify_error(error):
+    """
+    Определяет, стоит ли повторять операцию после ошибки.
+    Возвращает ERROR_THROTTLED (сервер ограничивает частоту запросов),
+    ERROR_TRANSIENT (временная сетевая ошибка) или ERROR_PERMANENT.
+    Просматривает всю цепочку исключений, включая исходное исключение,
+    которое yt_dlp сохраняет в DownloadError.exc_info.
+    """
+    result = ERROR_PERMANENT
+    seen = set()
+    pending = [error]
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+
+        status = getattr(current, 'status', None)
+        if not isinstance(status, int):
+            status = getattr(current, 'code', None)
+        statuses = {status} if isinstance(status, int) else set()
+        statuses.update(int(code) for code in _HTTP_STATUS_RE.findall(str(current)))
+        if statuses & _THROTTLE_STATUSES:
+            return ERROR_THROTTLED
+        if statuses & _TRANSIENT_STATUSES:
+            result = ERROR_TRANSIENT
+        elif isinstance(current, (TimeoutError, ConnectionError, socket.gaierror)):
+            result = ERROR_TRANSIENT
+        elif any(fragment in str(current).lower() for fragment in _TRANSIENT_MESSAGES):
+            result = ERROR_TRANSIENT
+
+        exc_info = getattr(current, 'exc_info', None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1:
+            pending.append(exc_info[1])
+        pending.append(current.__cause__)
+        pending.append(current.__context__)
+    return result
+
+
+class RetryPolicy:
+    def __init__(self, retries=3, base_delay=2.0, max_delay=60.0):
+        """
+        Повторы после временных ошибок с экспоненциальной задержкой и случайным разбросом.
+        :param retries: Максимальное число повторов (0 — не повторять).
+        :param base_delay: Задержка перед первым повтором в секундах.
+        :param max_delay: Верхняя граница задержки в секундах.
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, throttled=False):
+        """
+        Задержка перед повтором номер attempt (начиная с 0).
+        Случайный разброс в пределах половины задержки не даёт потокам,
+        получившим ошибку одновременно, повторить запрос тоже одновременно.
+        При ограничении частоты запросов сервером задержка удваивается.
+        """
+        limit = min(self.max_delay, self.base_delay * 2 ** (attempt + (1 if throttled else 0)))
+        return random.uniform(limit / 2, limit)
+
+
+class RateLimiter:
+    def __init__(self, rate=None, burst=1.0):
+        """
+        Общее ограничение скорости для всех загрузок («маркерная корзина»).
+        :param rate: Скорость в байтах в секунду (None или 0 — без ограничения).
+        :param burst: Сколько секунд трафика можно получить разом после простоя.
+        """
+        self._lock = threading.Lock()
+        self._rate = rate or None
+        self.burst = burst
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        with self._lock:
+            self._rate = value or None
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+    def consume(self, amount, stop_event=None):
+        """
+        Учитывает amount полученных байт и, если лимит превышен, приостанавливает
+        вызывающий поток на время, за которое эти байты «разрешены».
+        Долг может уходить в минус: каждый поток ждёт свою долю, поэтому
+        суммарная скорость всех загрузок держится около rate.
+        """
+        if amount <= 0:
+            return
+        with self._lock:
+            rate = self._rate
+            if not rate:
+                return
+            now = time.monotonic()
+            self._tokens = min(rate * self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            if stop_event is not None:
+                stop_event.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+class ConcurrencyController:
+    # Окон подряд, в течение которых число загрузок не увеличивается после снижения
+    HOLD_WINDOWS = 3
+
+    def __init__(self, max_workers, min_workers=1, adaptive=False, window=5.0,
+                 error_threshold=0.2, min_gain=0.05, on_change=None):
+        """
+        Ограничивает число одновременных загрузок и, если adaptive = True,
+        подбирает его по измеренной скорости и доле ошибок.
+
+        Раз в window секунд: при ограничении частоты запросов сервером (HTTP 429)
+        или доле ошибок выше error_threshold число загрузок уменьшается вдвое;
+        если все разрешённые загрузки заняты, число увеличивается на одну и
+        остаётся, только если скорость выросла хотя бы на min_gain.
+        :param max_workers: Верхняя граница (число потоков этапа скачивания).
+        :param min_workers: Нижняя граница.
+        :param adaptive: Подбирать число загрузок (False — всегда max_workers).
+        :param on_change: Вызывается как on_change(новое_число) при изменении.
+        """
+        self.max_workers = max(1, max_workers)
+        self.min_workers = max(1, min(min_workers, self.max_workers))
+        self.adaptive = adaptive
+        self.window = window
+        self.error_threshold = error_threshold
+        self.min_gain = min_gain
+        self.on_change = on_change
+        self._condition = threading.Condition()
+        # Адаптивный режим начинает с нижней границы и наращивает число загрузок
+        self._limit = self.min_workers if adaptive else self.max_workers
+        self._active = 0
+        self._probing = False  # Последнее изменение — пробное увеличение
+        self._hold = 0
+        self._previous_rate = None
+        self._reset_window(time.monotonic())
+
+    @property
+    def limit(self):
+        with self._condition:
+            return self._limit
+
+    def acquire(self, stop_event):
+        """
+        Ждёт свободного места для загрузки. Возвращает False, если загрузка остановлена.
+        """
+        with self._condition:
+            while self._active >= self._limit:
+                self._saturated = True
+                if stop_event.is_set():
+                    return False
+                self._condition.wait(0.5)
+            if stop_event.is_set():
+                return False
+            self._active += 1
+            if self._active >= self._limit:
+                self._saturated = True
+            return True
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def record_bytes(self, amount):
+        """
+        Учитывает скачанные байты для расчёта скорости.
+        """
+        if amount <= 0:
+            return
+        with self._condition:
+            self._bytes += amount
+            changed = self._maybe_adjust()
+        self._notify_change(changed)
+
+    def record_result(self, error_kind=None):
+        """
+        Учитывает результат одной попытки: None — успех, иначе вид ошибки из classify_error.
+        """
+        with self._condition:
+            if error_kind is None:
+                self._successes += 1
+            else:
+                self._failures += 1
+                if error_kind == ERROR_THROTTLED:
+                    self._throttled = True
+            changed = self._maybe_adjust()
+        self._notify_change(changed)
+
+    def _reset_window(self, now):
+        self._window_started = now
+        self._bytes = 0
+        self._successes = 0
+        self._failures = 0
+        self._throttled = False
+        self._saturated = self._active >= self._limit
+
+    def _notify_change(self, limit):
+        # Вызывается без блокировки: медленный обработчик (лог окна) не должен задерживать другие загрузки
+        if limit is not None and self.on_change is not None:
+            self.on_change(limit)
+
+    def _maybe_adjust(self):
+        """
+        Пересчитывает число загрузок по итогам окна. Вызывается под self._condition.
+        Возвращает новое число, если оно изменилось, иначе None.
+        """
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        if not self.adaptive or elapsed < self.window:
+            return None
+        if not self._bytes and not self._successes and not self._failures:
+            # Окно без загрузок (например, всё время шло перекодирование) ничего не говорит о сети
+            self._reset_window(now)
+            return None
+
+        rate = self._bytes / elapsed
+        attempts = self._successes + self._failures
+        limit = self._limit
+        if self._throttled or (attempts and self._failures / attempts > self.error_threshold):
+            limit = max(self.min_workers, self._limit // 2)
+            self._probing = False
+            self._hold = self.HOLD_WINDOWS
+        elif self._probing and self._previous_rate is not None \
+                and rate < self._previous_rate * (1 + self.min_gain):
+            # Пробное увеличение не дало заметного прироста — возвращаемся на шаг назад
+            limit = max(self.min_workers, self._limit - 1)
+            self._probing = False
+            self._hold = self.HOLD_WINDOWS
+        elif self._hold:
+            self._hold -= 1
+        elif self._saturated and self._limit < self.max_workers:
+            # Сразу после удачного увеличения пробуем следующее
+            limit = self._limit + 1
+            self._probing = True
+        else:
+            self._probing = False
+
+        self._previous_rate = rate
+        changed = None
+        if limit != self._limit:
+            self._limit = limit
+            self._condition.notify_all()
+            changed = limit
+        self._reset_window(now)
+        return changed
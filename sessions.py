@@ -0,0 +1,59 @@
+import threading
+
+
+class SessionPool:
+    def __init__(self, options_factory):
+        """
+        Долгоживущие экземпляры yt_dlp.YoutubeDL, по одному на поток.
+        Экземпляр переиспользуется для всех ссылок, которые обрабатывает поток:
+        сохраняются HTTP-соединения (keep-alive), cookies и созданные экстракторы.
+        :param options_factory: Функция без аргументов, возвращающая опции экземпляра.
+                                Если опции изменились (например, включён тихий режим),
+                                экземпляр потока пересоздаётся.
+        """
+        self._options_factory = options_factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._generation = 0  # Увеличивается при close(), чтобы потоки создали новые экземпляры
+
+    def get(self):
+        """
+        Возвращает экземпляр YoutubeDL текущего потока, создавая его при первом обращении.
+        """
+        options = self._options_factory()
+        session = getattr(self._local, 'session', None)
+        if session is not None and (self._local.generation != self._generation or self._local.options != options):
+            self._discard(session)
+            session = None
+        if session is None:
+            # yt_dlp загружается долго, поэтому импортируется только перед первой загрузкой
+            import yt_dlp
+
+            # Копия: YoutubeDL дополняет словарь опций при создании
+            session = yt_dlp.YoutubeDL(dict(options))
+            with self._lock:
+                self._sessions.add(session)
+                self._local.generation = self._generation
+            self._local.session = session
+            self._local.options = options
+        return session
+
+    def close(self):
+        """
+        Закрывает все экземпляры (и их соединения). Потоки, которые продолжат работу,
+        при следующем обращении получат новые экземпляры.
+        """
+        with self._lock:
+            sessions, self._sessions = self._sessions, set()
+            self._generation += 1
+        for session in sessions:
+            session.close()
+
+    def _discard(self, session):
+        with self._lock:
+            known = session in self._sessions
+            self._sessions.discard(session)
+        if known:
+            session.close()
+        self._local.session = None
@@ -0,0 +1,90 @@
+import errno
+import os
+import shutil
+import time
+
+# Подпапка выбранной рабочей папки, в которой идёт вся промежуточная работа.
+# Отдельная подпапка нужна, чтобы очистка не трогала чужие файлы (например, в /tmp).
+STAGING_DIRNAME = "YouTubeAudioDownloader"
+
+# Суффикс копии трека, которая ещё не дописана в библиотеку на другом диске
+INCOMPLETE_SUFFIX = ".incomplete"
+# Незавершённые файлы yt-dlp (.part, .ytdl, фрагменты .part-FragN) и копирования.
+# Только собственные: .tmp и .temp в папке библиотеки могут принадлежать другим программам
+PARTIAL_SUFFIXES = ('.part', '.ytdl', INCOMPLETE_SUFFIX)
+
+# Незавершённые файлы, которые не менялись дольше этого срока, считаются брошенными
+STALE_FILE_AGE = 7 * 24 * 3600
+
+# Размер блока при копировании трека в библиотеку на другом диске
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def finalize_file(source_path, target_path):
+    """
+    Переносит готовый файл из рабочей папки в библиотеку так, что по пути target_path
+    никогда не бывает недописанного файла. На том же диске это одно переименование.
+    На другом диске (например, tmpfs -> сетевая папка) файл копируется во временный
+    файл рядом с целью, сбрасывается на диск и переименовывается, затем исходник удаляется.
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    try:
+        os.replace(source_path, target_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp_path = target_path + INCOMPLETE_SUFFIX
+    try:
+        with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(source_path)
+
+
+def is_partial_file(name):
+    return name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name
+
+
+def cleanup_stale_files(folder, max_age=STALE_FILE_AGE, keep=(), partial_only=True):
+    """
+    Удаляет файлы, оставшиеся от прерванных запусков и не менявшиеся дольше max_age секунд.
+    :param folder: Папка, которая обходится рекурсивно.
+    :param keep: Пути, которые нельзя удалять (например, файлы из журнала задач).
+    :param partial_only: Удалять только незавершённые файлы (для папки библиотеки).
+                         False — любые файлы (для собственной рабочей папки);
+                         опустевшие подпапки при этом тоже удаляются.
+    :return: (число удалённых файлов, их общий размер в байтах)
+    """
+    keep = {os.path.abspath(path) for path in keep if path}
+    deadline = time.time() - max_age
+    removed = removed_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(folder, topdown=False):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if (partial_only and not is_partial_file(name)) or os.path.abspath(path) in keep:
+                continue
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > deadline:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            removed_bytes += stat.st_size
+        if not partial_only and dirpath != folder:
+            try:
+                os.rmdir(dirpath)  # Только если папка пуста
+            except OSError:
+                pass
+    return removed, removed_bytes
@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+BENCH_DIR = os.path.join(REPO_ROOT, 'benchmarks')
+# Папка benchmarks нужна в sys.path, чтобы yt_dlp нашёл экстракторы-заглушки
+for path in (BENCH_DIR, REPO_ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+try:
+    import yt_dlp  # noqa: F401
+except ImportError:
+    yt_dlp = None
+
+
+@unittest.skipIf(yt_dlp is None, "yt_dlp не установлен")
+class ExpandRedirectTest(unittest.TestCase):
+    def setUp(self):
+        from downloader import Downloader
+        from throughput import BenchServer
+
+        # Для раскрытия нужны только ответы API плейлиста, медиафайлы не запрашиваются
+        self.server = BenchServer({}, duration=1)
+        self.server.start()
+        self.folder = tempfile.TemporaryDirectory()
+        self.downloader = Downloader(self.folder.name, lambda message: None, lambda value: None)
+        self.downloader.quiet = True
+
+    def tearDown(self):
+        self.downloader.close_sessions()
+        self.downloader.archive.close()
+        self.downloader.journal.close()
+        self.server.stop()
+        self.folder.cleanup()
+
+    def test_playlist_behind_url_result_is_expanded_into_tracks(self):
+        url = f'{self.server.base_url}/bench/redirect/3'
+        tracks = list(self.downloader._expand(url))
+
+        self.assertEqual([track.info['id'] for track in tracks], ['track0001', 'track0002', 'track0003'])
+        self.assertEqual({track.playlist['playlist_title'] for track in tracks}, {'Benchmark 3'})
+        self.assertEqual([track.playlist['playlist_index'] for track in tracks], [1, 2, 3])
+
+    def test_plain_playlist_is_unchanged(self):
+        url = f'{self.server.base_url}/bench/playlist/2'
+        tracks = list(self.downloader._expand(url))
+
+        self.assertEqual([track.info['id'] for track in tracks], ['track0001', 'track0002'])
+
+    def test_playlist_entry_that_is_a_playlist_is_not_downloaded_as_one_track(self):
+        if not self.downloader._ffmpeg_available():
+            self.skipTest("ffmpeg не найден")
+        url = f'{self.server.base_url}/bench/shelf/2'
+        [container] = list(self.downloader._expand(url))
+
+        nested = self.downloader._fetch(container)
+
+        self.assertEqual(nested.get('_type'), 'playlist')
+        self.assertEqual(container.stage, None)
+        tracks = list(self.downloader._tracks_to_download(url, nested))
+        self.assertEqual([track.info['id'] for track in tracks], ['track0001', 'track0002'])
+        self.assertEqual({track.playlist['playlist_title'] for track in tracks}, {'Benchmark 2'})
+        files = [name for _, _, names in os.walk(self.folder.name) for name in names]
+        self.assertFalse([name for name in files if name.endswith(('.webm', '.part'))])
+
+
+if __name__ == '__main__':
+    unittest.main()
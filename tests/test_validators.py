@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from validators import canonical_youtube_url, extract_video_id  # noqa: E402
+
+
+class CanonicalYoutubeUrlTest(unittest.TestCase):
+    def test_video_and_playlist_urls_are_moved_to_www(self):
+        self.assertEqual(
+            canonical_youtube_url('music.youtube.com/watch?v=dQw4w9WgXcQ&feature=share'),
+            'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        )
+        self.assertEqual(
+            canonical_youtube_url('https://m.youtube.com/playlist?list=PL1234567890'),
+            'https://www.youtube.com/playlist?list=PL1234567890',
+        )
+
+    def test_mix_urls_keep_the_watch_page(self):
+        self.assertEqual(
+            canonical_youtube_url('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ&start_radio=1'),
+            'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ',
+        )
+        self.assertEqual(
+            canonical_youtube_url('https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RDAMVMdQw4w9WgXcQ'),
+            'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDAMVMdQw4w9WgXcQ',
+        )
+        self.assertIsNone(extract_video_id('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDMM'))
+
+    def test_other_urls_keep_their_host(self):
+        self.assertEqual(
+            canonical_youtube_url('https://Music.YouTube.com/browse/MPREb_abc123/'),
+            'https://music.youtube.com/browse/MPREb_abc123',
+        )
+        self.assertEqual(
+            canonical_youtube_url('www.youtube.com/@channel/videos'),
+            'https://www.youtube.com/@channel/videos',
+        )
+
+    def test_non_youtube_urls_are_rejected(self):
+        self.assertIsNone(canonical_youtube_url('https://example.com/watch?v=dQw4w9WgXcQ'))
+        self.assertIsNone(canonical_youtube_url('https://www.youtube.com/watch?v=short'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import threading
+from shutil import which
+
+# Файл с результатом поиска ffmpeg в PATH между запусками
+TOOLS_CACHE_FILENAME = "tools.json"
+
+_lock = threading.Lock()
+_cached = None  # Результат поиска в текущем процессе
+
+
+def bin_dir():
+    """
+    Папка bin проекта с ffmpeg.
+    Если приложение запущено из собранного exe (PyInstaller), используется sys._MEIPASS.
+    """
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, 'bin')
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+
+
+def cache_dir():
+    """
+    Папка для служебных файлов приложения в профиле пользователя.
+    """
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'YouTubeAudioDownloader')
+
+
+def find_ffmpeg():
+    """
+    Находит ffmpeg и ffprobe: сначала в папке bin проекта, затем в PATH.
+    Возвращает кортеж (ffmpeg_path, ffprobe_path, source), где source — 'bin', 'path'
+    или None, если ffmpeg не найден.
+
+    Результат запоминается в процессе и (для PATH) в файле в профиле пользователя,
+    поэтому обход PATH выполняется заново, только если найденные файлы пропали.
+    """
+    global _cached
+    with _lock:
+        if _cached is not None and _is_valid(_cached):
+            return _cached
+
+        # Проверка папки bin — это два stat, её выполняем всегда:
+        # путь sys._MEIPASS у собранного exe меняется при каждом запуске
+        base_dir = bin_dir()
+        bin_ffmpeg = os.path.join(base_dir, 'ffmpeg.exe')
+        bin_ffprobe = os.path.join(base_dir, 'ffprobe.exe')
+        if os.path.exists(bin_ffmpeg) and os.path.exists(bin_ffprobe):
+            _cached = (bin_ffmpeg, bin_ffprobe, 'bin')
+            return _cached
+
+        stored = _load()
+        if stored is not None and _is_valid(stored):
+            _cached = stored
+            return _cached
+
+        # Если ffmpeg не найден в bin, ищем в системном PATH
+        ffmpeg_path = which("ffmpeg")
+        ffprobe_path = which("ffprobe")
+        result = (ffmpeg_path, ffprobe_path, 'path' if ffmpeg_path else None)
+        if ffmpeg_path:
+            _save(result)
+            _cached = result
+        return result
+
+
+def _is_valid(result):
+    ffmpeg_path, ffprobe_path, _ = result
+    if not ffmpeg_path or not os.path.exists(ffmpeg_path):
+        return False
+    return ffprobe_path is None or os.path.exists(ffprobe_path)
+
+
+def _load():
+    path = os.path.join(cache_dir(), TOOLS_CACHE_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data['ffmpeg'], data.get('ffprobe'), 'path'
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save(result):
+    ffmpeg_path, ffprobe_path, _ = result
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(os.path.join(cache_dir(), TOOLS_CACHE_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'ffmpeg': ffmpeg_path, 'ffprobe': ffprobe_path}, f)
+    except OSError:
+        # Кэш — только ускорение: без него ffmpeg просто будет искаться заново
+        pass
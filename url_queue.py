@@ -0,0 +1,63 @@
+from validators import canonical_youtube_url
+
+
+class UrlQueue:
+    def __init__(self):
+        """
+        Очередь ссылок с индексом по каноническому виду ссылки.
+        Добавление, проверка дубликата и удаление выполняются за O(1);
+        список для отображения по номеру строки собирается заново только после удаления.
+        """
+        self._items = {}  # каноническая ссылка -> None (словарь сохраняет порядок добавления)
+        self._order = []  # Те же ссылки списком, для доступа по номеру строки
+        self._order_valid = True
+
+    def add(self, url):
+        """
+        Добавляет ссылку в канонической форме.
+        Возвращает добавленную ссылку или None, если она некорректна или уже в очереди.
+        """
+        canonical = canonical_youtube_url(url)
+        if canonical is None or canonical in self._items:
+            return None
+        self._items[canonical] = None
+        if self._order_valid:
+            self._order.append(canonical)
+        return canonical
+
+    def __contains__(self, url):
+        return (canonical_youtube_url(url) or url) in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __getitem__(self, index):
+        """
+        Ссылка (или срез ссылок) по номеру строки, как у списка.
+        """
+        if not self._order_valid:
+            self._order = list(self._items)
+            self._order_valid = True
+        return self._order[index]
+
+    def remove(self, url):
+        """
+        Удаляет ссылку. Возвращает True, если она была в очереди.
+        """
+        if url not in self._items:
+            return False
+        del self._items[url]
+        # Список по номерам пересобирается лениво, при следующем обращении
+        self._order_valid = False
+        return True
+
+    def clear(self):
+        self._items.clear()
+        self._order = []
+        self._order_valid = True
+
+    def urls(self):
+        return list(self._items)
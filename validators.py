@@ -1,12 +1,154 @@
 import re
+from urllib.parse import parse_qs, urlsplit
+
+# Домены YouTube (включая мобильную версию и YouTube Music)
+_YOUTUBE_HOSTS = {
+    'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+    'youtube-nocookie.com', 'www.youtube-nocookie.com',
+}
+_SHORT_HOSTS = {'youtu.be', 'www.youtu.be'}
+# Пути, в которых за префиксом следует ID видео: /shorts/ID, /embed/ID и т.д.
+_VIDEO_PATH_PREFIXES = ('shorts', 'embed', 'live', 'v', 'e')
+
+_VIDEO_ID_RE = re.compile(r"^[0-9A-Za-z_-]{11}$")
+_PLAYLIST_ID_RE = re.compile(r"^[0-9A-Za-z_-]{2,64}$")
+_SCHEME_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+def _split_url(url):
+    text = url.strip()
+    if not _SCHEME_RE.match(text):
+        text = "https://" + text
+    try:
+        parts = urlsplit(text)
+        host = (parts.hostname or '').lower()
+    except ValueError:
+        return None
+    return host, parts
+
+
+def _parse_ids(url):
+    """
+    Возвращает (ID видео, ID плейлиста) из ссылки на YouTube, каждый — None, если его нет
+    или он некорректен. Для ссылок не на YouTube возвращает None.
+    """
+    split = _split_url(url)
+    if split is None:
+        return None
+    host, parts = split
+    query = parse_qs(parts.query)
+    segments = [segment for segment in parts.path.split('/') if segment]
+
+    video_id = None
+    if host in _SHORT_HOSTS:
+        video_id = segments[0] if segments else None
+    elif host in _YOUTUBE_HOSTS:
+        if segments[:1] == ['watch']:
+            video_id = query.get('v', [None])[0]
+        elif len(segments) > 1 and segments[0] in _VIDEO_PATH_PREFIXES:
+            video_id = segments[1]
+    else:
+        return None
+
+    playlist_id = query.get('list', [None])[0]
+    if not (playlist_id and _PLAYLIST_ID_RE.match(playlist_id)):
+        playlist_id = None
+    if not (video_id and _VIDEO_ID_RE.match(video_id)):
+        video_id = None
+    return video_id, playlist_id
+
+
+def _is_mix_playlist(playlist_id):
+    """
+    Проверяет, что плейлист — микс (радио) YouTube: RD..., RDMM, RDAMVM... из YouTube Music.
+    yt_dlp получает миксы только со страницы видео, поэтому ссылку на микс нельзя
+    переписывать в /playlist?list=.
+    """
+    return playlist_id.startswith('RD')
+
+
+def parse_youtube_url(url):
+    """
+    Разбирает ссылку на YouTube без сетевых запросов.
+    Возвращает ('video', ID видео), ('playlist', ID плейлиста) или None для
+    нераспознанных ссылок. Поддерживаются youtu.be, watch?v=, shorts, embed, live,
+    m. и music.youtube.com. Ссылка с параметром list= считается плейлистом.
+    """
+    ids = _parse_ids(url)
+    if ids is None:
+        return None
+    video_id, playlist_id = ids
+    if playlist_id:
+        return 'playlist', playlist_id
+    if video_id:
+        return 'video', video_id
+    return None
+
+
+def canonical_youtube_url(url):
+    """
+    Приводит ссылку на YouTube к единому виду, чтобы разные записи одного видео
+    или плейлиста совпадали: https://www.youtube.com/watch?v=ID или
+    https://www.youtube.com/playlist?list=ID. Миксы остаются ссылкой на страницу
+    видео: https://www.youtube.com/watch?v=ID&list=RD... (см. _is_mix_playlist).
+    Прочие ссылки на YouTube (каналы, альбомы YouTube Music и т.п.) только
+    нормализуются и остаются на исходном домене: у music.youtube.com свои пути,
+    которых нет на www.youtube.com.
+    Возвращает None, если это не ссылка на YouTube.
+    """
+    ids = _parse_ids(url)
+    if ids is not None:
+        video_id, playlist_id = ids
+        if playlist_id and video_id and _is_mix_playlist(playlist_id):
+            return f"https://www.youtube.com/watch?v={video_id}&list={playlist_id}"
+        if playlist_id:
+            return f"https://www.youtube.com/playlist?list={playlist_id}"
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+
+    split = _split_url(url)
+    if split is None:
+        return None
+    host, parts = split
+    path = parts.path.rstrip('/')
+    if host not in _YOUTUBE_HOSTS or not path:
+        return None
+    # Ссылка на видео или плейлист без корректного ID
+    if path.split('/')[1] in ('watch', 'playlist') + _VIDEO_PATH_PREFIXES:
+        return None
+    return f"https://{host}{path}" + (f"?{parts.query}" if parts.query else "")
+
 
 def is_valid_youtube_url(url):
     """
     Проверяет, что переданный URL является ссылкой на YouTube или плейлист YouTube.
     """
-    # Можно расширить, добавив проверку на youtube.com, youtu.be, а также различные варианты URL.
-    youtube_regex = re.compile(r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$")
-    return bool(youtube_regex.match(url))
+    return canonical_youtube_url(url) is not None
+
+
+def extract_video_id(url):
+    """
+    Извлекает ID видео из ссылки на YouTube без сетевых запросов.
+    Возвращает None для ссылок на плейлисты и нераспознанных ссылок.
+    """
+    parsed = parse_youtube_url(url)
+    if parsed is None or parsed[0] != 'video':
+        return None
+    return parsed[1]
+
+
+def split_urls(text):
+    """
+    Разбивает текст (содержимое файла или буфера обмена) на ссылки:
+    разделители — пробелы и переводы строк, строки, начинающиеся с '#', пропускаются.
+    """
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.extend(line.split())
+    return urls
+
 
 def sanitize_filename(name):
     """
@@ -0,0 +1,177 @@
+import os
+import socket
+import threading
+
+from jobserver import RESULT_DONE, RESULT_FAILED, RESULT_RELEASED
+from scheduler import DownloadCancelled
+from validators import extract_video_id
+
+# Пауза между запросами задач, когда очередь пуста или сервер недоступен, секунд
+POLL_INTERVAL = 2.0
+
+
+class JobWorker:
+    def __init__(self, client, downloader, name, poll_interval=POLL_INTERVAL, event_callback=None):
+        """
+        Исполнитель: берёт задачи у координатора (см. jobserver.JobQueue) и выполняет
+        их обычным конвейером Downloader. Процессов-исполнителей может быть сколько
+        угодно на одной или нескольких машинах — так загрузка и ffmpeg масштабируются
+        за пределы одного процесса Python.
+        Задача-плейлист (канал, альбом) не скачивается здесь целиком: исполнитель раскрывает
+        её и ставит записи в очередь координатора отдельными задачами, которые разбирают
+        все исполнители.
+        Пока задача выполняется, аренда продлевается сигналами; если аренда потеряна,
+        задача прерывается, потому что координатор уже отдал её другому исполнителю.
+        :param client: jobserver.JobClient.
+        :param downloader: Настроенный Downloader (потоки, формат, метаданные и т.д.).
+        :param name: Уникальное имя исполнителя.
+        :param event_callback: Необязательный обработчик событий event_callback(event, fields).
+        """
+        self.client = client
+        self.downloader = downloader
+        self.name = name
+        self.poll_interval = poll_interval
+        self.event_callback = event_callback
+        self.stop_event = threading.Event()
+        self._errors = []  # Сообщения об ошибках текущей задачи
+        # Ошибки отдельных треков собираются для отчёта, события передаются дальше
+        self._downstream = downloader.event_callback
+        downloader.event_callback = self._on_download_event
+
+    def run(self, exit_when_finished=False):
+        """
+        Выполняет задачи, пока не вызван stop(). Возвращает число неудачных задач.
+        :param exit_when_finished: Завершиться, когда на сервере не останется задач
+                                   (ни в очереди, ни в аренде у других исполнителей).
+        """
+        failed = 0
+        while not self.stop_event.is_set():
+            try:
+                jobs, finished = self.client.lease(self.name)
+            except OSError as e:
+                self._emit('worker_error', message=f"Сервер задач недоступен: {e}")
+                self.stop_event.wait(self.poll_interval)
+                continue
+            if not jobs:
+                if finished and exit_when_finished:
+                    break
+                self.stop_event.wait(self.poll_interval)
+                continue
+            for job in jobs:
+                if self._run_job(job) == RESULT_FAILED:
+                    failed += 1
+        return failed
+
+    def stop(self):
+        """
+        Останавливает исполнителя; текущая задача возвращается в очередь.
+        Можно вызывать из любого потока.
+        """
+        self.stop_event.set()
+        self.downloader.stop_download()
+
+    def _run_job(self, job):
+        job_id = job['id']
+        self._errors = []
+        lease_lost = threading.Event()
+        done = threading.Event()
+        self._emit('job_started', id=job_id, url=job['url'])
+
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job_id, job['lease_seconds'] / 3, done, lease_lost),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            if extract_video_id(job['url']) is None:
+                details = self._split_job(job)
+            else:
+                details = self._download_job(job)
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if lease_lost.is_set():
+            # Итог уже не примут: задача отдана другому исполнителю
+            self._emit('job_lost', id=job_id, url=job['url'])
+            return None
+        if self.stop_event.is_set():
+            result = RESULT_RELEASED
+        elif details.get('failed') or self._errors:
+            result = RESULT_FAILED
+        else:
+            result = RESULT_DONE
+        if self._errors:
+            details['errors'] = self._errors[:10]
+        try:
+            self.client.report(self.name, job_id, result, details)
+        except OSError as e:
+            # Без отчёта аренда истечёт и задача вернётся в очередь
+            self._emit('worker_error', message=f"Не удалось отправить итог задачи {job_id}: {e}")
+        self._emit('job_finished', id=job_id, url=job['url'], result=result, **details)
+        return result
+
+    def _download_job(self, job):
+        playlists = {job['url']: job['playlist']} if job.get('playlist') else None
+        self.downloader.start_download([job['url']], lambda: None, playlists)
+        if self.stop_event.is_set():
+            # stop() пришёл, пока задача запускалась: start_download сбрасывает флаг остановки
+            self.downloader.stop_download()
+        self.downloader.thread.join()
+        snapshot = self.downloader.tracker.snapshot()
+        return {'completed': snapshot['completed'], 'failed': snapshot['failed']}
+
+    def _split_job(self, job):
+        """
+        Раскрывает задачу-плейлист и ставит её записи в очередь координатора
+        вместе с полями плейлиста (альбом, номер трека).
+        """
+        try:
+            entries = self.downloader.list_entries(job['url'])
+        except DownloadCancelled:
+            return {}
+        except Exception as e:
+            self._errors.append(f"{job['url']}: {e}")
+            return {}
+        if self.stop_event.is_set():
+            return {}
+        urls = [url for url, _ in entries]
+        playlists = {url: playlist for url, playlist in entries if playlist}
+        try:
+            added, rejected = self.client.add(urls, playlists)
+        except OSError as e:
+            self._errors.append(f"Не удалось поставить записи плейлиста в очередь: {e}")
+            return {}
+        self._emit('job_split', id=job['id'], url=job['url'], entries=len(entries), added=added)
+        details = {'entries': len(entries), 'added': added}
+        if rejected:
+            # Повтор задачи их не исправит, поэтому это не ошибка задачи
+            details['rejected'] = rejected[:10]
+        return details
+
+    def _heartbeat(self, job_id, interval, done, lease_lost):
+        while not done.wait(interval):
+            try:
+                lost = self.client.heartbeat(self.name, [job_id])
+            except OSError:
+                # Временная недоступность сервера: аренда может ещё не истечь
+                continue
+            if lost:
+                lease_lost.set()
+                self.downloader.stop_download()
+                return
+
+    def _on_download_event(self, event, fields):
+        if event == 'error':
+            self._errors.append(f"{fields.get('id')}: {fields.get('message')}")
+        if self._downstream is not None:
+            self._downstream(event, fields)
+
+    def _emit(self, event, **fields):
+        if self.event_callback is not None:
+            self.event_callback(event, dict(fields, worker=self.name))
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"